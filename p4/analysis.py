@@ -1,75 +1,180 @@
 import xml.etree.cElementTree as ET
 import pprint
-import re
+import sys
+from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 import operator
 
-# count_tag, count_attribute
-tree = ET.parse("./input/sample.osm")
+import element_source
 
-# unique_key, explore_path, count_county
-trees = ET.iterparse("./input/sample.osm")
+OSM_PATH = "./input/sample.osm"
+# Top level elements the aggregators see
+ANALYZED_TAGS = ('bounds',) + element_source.TOP_LEVEL
 
-def count_tag(path):
-	tags = {}
-	for elem in tree.iter():
-		if elem.tag not in tags:
-			tags[elem.tag] = 1
-		else:
-			tags[elem.tag] += 1
-	pprint.pprint(tags)
+# ================================================== #
+#               Aggregators                          #
+# ================================================== #
+# Each aggregator sees every top level element (node, way, relation, ...) once,
+# with its children, before the element is cleared. Register any number of them
+# with analyze() and they are all computed in a single pass over the file.
+# Subclasses must implement update() and result().
 
-#count_tag(tree)
+class Aggregator(object):
+	__metaclass__ = ABCMeta
 
-def count_attribute(path):
-	tag_keys = ["node", "node/tag", "way", "way/nd", "way/tag"]
+	def begin(self, root):
+		"""Called once with the <osm> root element (attributes only)"""
+		pass
 
-	for tag in tag_keys:
-		attributes = {}
-		for element in tree.findall(tag):
-		    for attr in element.attrib.keys():
-		    	if attr in attributes:
-		        	attributes[attr] += 1
-		        else:
-		        	attributes[attr] = 1
-		print tag
-		pprint.pprint(attributes)
+	@abstractmethod
+	def update(self, element):
+		"""Called with each top level element"""
 
-#count_attribute(tree)
+	@abstractmethod
+	def result(self):
+		"""The aggregate of every element seen so far"""
 
-def unique_key(path):
-	uk = defaultdict(int)
-	for _, element in trees:
-		if element.tag == 'node' or element.tag == 'way':
+	def report(self):
+		pprint.pprint(self.result())
+
+
+class TagCounter(Aggregator):
+	"""Count every xml tag in the file (count_tag)"""
+
+	def __init__(self):
+		self.tags = defaultdict(int)
+
+	def begin(self, root):
+		self.tags[root.tag] += 1
+
+	def update(self, element):
+		for elem in element.iter():
+			self.tags[elem.tag] += 1
+
+	def result(self):
+		return dict(self.tags)
+
+
+class AttributeCounter(Aggregator):
+	"""Count attribute names per element path such as 'node' or 'way/nd' (count_attribute)"""
+
+	def __init__(self, tag_keys=("node", "node/tag", "way", "way/nd", "way/tag")):
+		self.tag_keys = tag_keys
+		self.attributes = dict((tag, defaultdict(int)) for tag in tag_keys)
+
+	def _count(self, path, elem):
+		if path in self.attributes:
+			attributes = self.attributes[path]
+			for attr in elem.attrib:
+				attributes[attr] += 1
+
+	def update(self, element):
+		self._count(element.tag, element)
+		for child in element:
+			self._count(element.tag + '/' + child.tag, child)
+
+	def result(self):
+		return [(tag, dict(self.attributes[tag])) for tag in self.tag_keys]
+
+	def report(self):
+		for tag, attributes in self.result():
+			print tag
+			pprint.pprint(attributes)
+
+
+class TopKeys(Aggregator):
+	"""Most common tag keys on nodes and ways (unique_key)"""
+
+	def __init__(self, k=20, elements=('node', 'way')):
+		self.k = k
+		self.elements = elements
+		self.keys = defaultdict(int)
+
+	def update(self, element):
+		if element.tag in self.elements:
 			for child in element:
 				if child.tag == 'tag':
-					uk[child.attrib['k']] +=1
-	sorted_uk = sorted(uk.items(), key=operator.itemgetter(1), reverse = True)[0:20]
-	pprint.pprint(sorted_uk)
+					self.keys[child.attrib['k']] += 1
 
-#unique_key(trees)
+	def result(self):
+		return sorted(self.keys.items(), key=operator.itemgetter(1), reverse = True)[0:self.k]
 
-def explore_path(path):
-	ep = defaultdict(int)
-	for _, element in trees:
-		if element.tag == 'node' or element.tag == 'way':
+
+class ValueCounter(Aggregator):
+	"""Histogram of the values of the given tag keys on nodes and ways (count_county)"""
+
+	def __init__(self, keys, elements=('node', 'way')):
+		self.keys = set(keys)
+		self.elements = elements
+		self.values = defaultdict(int)
+
+	def update(self, element):
+		if element.tag in self.elements:
 			for child in element:
-				if child.tag == 'tag':
-					if child.attrib['k'] == 'addr:county':
-						ep[child.attrib['v']] += 1
-	pprint.pprint(list(ep))
+				if child.tag == 'tag' and child.attrib['k'] in self.keys:
+					self.values[child.attrib['v']] += 1
 
-#explore_path(trees)
+	def result(self):
+		return sorted(self.values.items(), key=operator.itemgetter(1), reverse = True)
+
+
+class DistinctValues(ValueCounter):
+	"""Distinct values of the given tag keys (explore_path)"""
+
+	def result(self):
+		return list(self.values)
+
+
+# ================================================== #
+#               Streaming Engine                     #
+# ================================================== #
+def read_root(path):
+	"""The <osm> root element and its attributes, without parsing past its start tag"""
+
+	with open(path, 'rb') as osm_file:
+		return next(ET.iterparse(osm_file, events=('start',)))[1]
+
+
+def analyze(path, aggregators, backend=element_source.DEFAULT_BACKEND):
+	"""
+	Stream the file once through element_source, feeding every top level element in
+	ANALYZED_TAGS to every aggregator. The source drops each element afterwards, so
+	memory stays flat regardless of the file size.
+	"""
+
+	root = read_root(path)
+	for aggregator in aggregators:
+		aggregator.begin(root)
+
+	for elem in element_source.iter_elements(path, ANALYZED_TAGS, backend):
+		for aggregator in aggregators:
+			aggregator.update(elem)
+
+	return aggregators
+
+
+def count_tag(path):
+	analyze(path, [TagCounter()])[0].report()
+
+def count_attribute(path):
+	analyze(path, [AttributeCounter()])[0].report()
+
+def unique_key(path):
+	analyze(path, [TopKeys()])[0].report()
+
+def explore_path(path):
+	analyze(path, [DistinctValues(['addr:county'])])[0].report()
 
 def count_county(path):
-	uk = defaultdict(int)
-	for _, element in trees:
-		if element.tag == 'node' or element.tag == 'way':
-			for child in element:
-				if child.tag == 'tag':
-					if child.attrib['k'] == 'tiger:county' or child.attrib['k'] == 'addr:county':
-						uk[child.attrib['v']] +=1
-	sorted_uk = sorted(uk.items(), key=operator.itemgetter(1), reverse = True)
-	pprint.pprint(sorted_uk)
+	analyze(path, [ValueCounter(['tiger:county', 'addr:county'])])[0].report()
+
+
+if __name__ == '__main__':
+	path = sys.argv[1] if len(sys.argv) > 1 else OSM_PATH
+	backend = sys.argv[2] if len(sys.argv) > 2 else element_source.DEFAULT_BACKEND
 
-count_county(trees)
\ No newline at end of file
+	# All of the above in one pass over the file
+	for aggregator in analyze(path, [TagCounter(), AttributeCounter(), TopKeys(),
+	                                 ValueCounter(['tiger:county', 'addr:county'])], backend):
+		print aggregator.__class__.__name__
+		aggregator.report()
@@ -1,8 +1,10 @@
-import xml.etree.cElementTree as ET
+import element_source
 from pprint import pformat
 import pprint
 import re
-from collections import defaultdict
+import time
+from collections import defaultdict, OrderedDict
+from functools import wraps
 
 osmfile = './input/sample.osm'
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
@@ -12,6 +14,12 @@ capitalize_re = re.compile(r'\b[A-Z]+\b')
 postal_re = re.compile(r'\D+')
 county_re = re.compile(r'[\:]|[\;]')
 
+phone_re = re.compile(r'\d{3}\-\d{3}\-\d{4}')
+phone_dash_prefix_re = re.compile(r'\-\d{3}\-\d{3}\-\d{4}')
+phone_country_re = re.compile(r'\d{1}\-\d{3}\-\d{3}\-\d{4}')
+phone_digits_re = re.compile(r'\d{9}')
+phone_six_four_re = re.compile(r'\d{6}\-\d{4}')
+
 expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Lane", "Road", 
             "Trail", "Parkway", "Ridge", "Way", "Pass", "Creek", "Chase", "Crossing",
             "Terrace", "Point", "Path", "Loop", "Run", "Cove", 'Bend', 'Circle', 'Trace', 'Walk',
@@ -25,64 +33,127 @@ def audit_street_type(street_types, street_name):
 		if street_type not in expected:
 			street_types[street_type].add(street_name)
 			
-def audit(osmfile):
-	osm_file = open(osmfile, 'r')
-	street_types = defaultdict(set)
-	for event, elem in ET.iterparse('./input/sample.osm', events=("start",)):
-			if elem.tag == 'node'  or elem.tag == 'way':
-				for tag in elem.iter('tag'):
-					if is_street_name(tag):
-						audit_street_type(street_types, tag.attrib['v'])
-	osm_file.close()
-
+def is_street_name(elem):
+	return elem.attrib['k'] == "addr:street"
 
-def update_street(name, street_issue):
+def audit(osmfile, backend=element_source.DEFAULT_BACKEND):
+	street_types = defaultdict(set)
+	for elem in element_source.iter_elements(osmfile, ('node', 'way'), backend):
+		for tag in elem.iter('tag'):
+			if is_street_name(tag):
+				audit_street_type(street_types, tag.attrib['v'])
+	return street_types
+
+
+# ================================================== #
+#               Cleaner Cache                        #
+# ================================================== #
+# The same raw values repeat thousands of times in an extract, so every cleaner
+# shares one bounded LRU cache keyed on (cleaner, raw value).
+CACHE_SIZE = 50000
+_cache = OrderedDict()
+
+CLEANER_STATS = defaultdict(lambda: {'hits': 0, 'misses': 0, 'time': 0.0})
+
+
+def cached_cleaner(name):
+	"""Memoize a one-argument cleaning function in the shared cache, counting hits/misses/time"""
+
+	def decorator(func):
+
+		@wraps(func)
+		def wrapper(value):
+			stats = CLEANER_STATS[name]
+			start = time.time()
+			key = (name, value)
+
+			try:
+				result = _cache.pop(key)
+				stats['hits'] += 1
+			except KeyError:
+				result = func(value)
+				stats['misses'] += 1
+				if len(_cache) >= CACHE_SIZE:
+					_cache.popitem(last=False)
+
+			_cache[key] = result
+			stats['time'] += time.time() - start
+			return result
+
+		return wrapper
+
+	return decorator
+
+
+def merge_cleaner_stats(stats):
+	"""Add counters collected in another process into CLEANER_STATS"""
+
+	for name, counters in stats.iteritems():
+		for counter, value in counters.iteritems():
+			CLEANER_STATS[name][counter] += value
+
+
+def print_cleaner_stats():
+	"""Print per-cleaner hit rate and time spent, for the end of process_map"""
+
+	print "{0:<10}{1:>10}{2:>10}{3:>10}{4:>10}".format('cleaner', 'hits', 'misses', 'hit rate', 'seconds')
+	for name, stats in sorted(CLEANER_STATS.items()):
+		calls = stats['hits'] + stats['misses']
+		print "{0:<10}{1:>10}{2:>10}{3:>10.1%}{4:>10.3f}".format(
+			name, stats['hits'], stats['misses'], float(stats['hits']) / calls if calls else 0.0, stats['time'])
+
+
+# ================================================== #
+#               Cleaning Functions                   #
+# ================================================== #
+mapping = { "St": "Street",
+            "St.": "Street",
+            "Blvd": "Boulevard",
+            "Blvd.": "Boulevard",
+            "Ave": "Avenue",
+            "Ave.": "Avenue",
+            "Rd.": "Road",
+            "Rd" : "Road,",
+            "Dr" : "Drive",
+            "Dr.": "Drive",
+            "Trl": "Trail",
+            "Rd" : "Road",
+            "Ln" : "Lane",
+            "Cir": "Circle",
+            "Ct" : "Court",
+            "Hwy": "Highway",
+            "Trce": "Trace",
+            "Pkwy": "Parkway",
+            "Pl": "Place",
+            "Xing": "Crossing",
+            "Ter": "Terrace",
+            "Mhp": "Mobile Home Park",
+            "Crst": "Crest",
+            "Lndg": "Landing",
+            "Pt": "Point",
+            "S": "South",
+            "S.": "South",
+            "W": "West",
+            "W.": "West",
+            "N": "North",
+            "N.": "North",
+            "E": "East",
+            "E.": "East",
+            "NE": "Northeast",
+            "NW": "Northwest",
+            "SE": "Southeast",
+            "SW": "Southwest",
+            "Hts": "Heights",
+            "Rte": "Route"}
+
+
+@cached_cleaner('street')
+def clean_street(name):
 	"""
-	Takes in street suffix and determines if it is an expected suffix. 
-	If not, function checks whether suffix is an abbreviation issue (from mapping) and corrects it if true.
-	Also checks to make sure no lowercase issues.
+	Return (cleaned name, unexpected suffix or None).
+	Kept free of side effects so the result can be cached.
 	"""
 
-	mapping = { "St": "Street",
-                "St.": "Street",
-                "Blvd": "Boulevard",
-                "Blvd.": "Boulevard",
-                "Ave": "Avenue",
-                "Ave.": "Avenue",
-                "Rd.": "Road",
-                "Rd" : "Road,",
-                "Dr" : "Drive",
-                "Dr.": "Drive",
-                "Trl": "Trail",
-                "Rd" : "Road",
-                "Ln" : "Lane",
-                "Cir": "Circle",
-                "Ct" : "Court",
-                "Hwy": "Highway",
-                "Trce": "Trace",
-                "Pkwy": "Parkway",
-                "Pl": "Place",
-                "Xing": "Crossing",
-                "Ter": "Terrace",
-                "Mhp": "Mobile Home Park",
-                "Crst": "Crest",
-                "Lndg": "Landing",
-                "Pt": "Point",
-                "S": "South",
-                "S.": "South",
-                "W": "West",
-                "W.": "West",
-                "N": "North",
-                "N.": "North",
-                "E": "East",
-                "E.": "East",
-                "NE": "Northeast",
-                "NW": "Northwest",
-                "SE": "Southeast",
-                "SW": "Southwest",
-                "Hts": "Heights",
-                "Rte": "Route"}
-
 	nn = street_type_re.search(name)
 	ll = lowercase_re.search(name)
 	cc = capitalize_re.search(name)
@@ -93,48 +164,61 @@ def update_street(name, street_issue):
 			
 			if street_type in mapping:
 
-				name = re.sub(street_type_re, mapping[street_type], name)
+				name = street_type_re.sub(mapping[street_type], name)
 
 			elif ll or cc:
 				name = name.title()
-				return name
+				return name, None
 
 			else:
-				street_issue[street_type] += 1
-				return name
+				return name, street_type
+
+	return name, None
+
+
+def update_street(name, street_issue):
+	"""
+	Takes in street suffix and determines if it is an expected suffix. 
+	If not, function checks whether suffix is an abbreviation issue (from mapping) and corrects it if true.
+	Also checks to make sure no lowercase issues.
+	"""
 
+	name, street_type = clean_street(name)
+	if street_type is not None:
+		street_issue[street_type] += 1
 	return name
 
 
+@cached_cleaner('phone')
 def update_phone(n):
 	""" Formatting phone numbers to ###-###-#### """
 
-	match = re.match(re.compile(r'\d{3}\-\d{3}\-\d{4}'),n)
+	match = phone_re.match(n)
 				
 	if match is None:
 		
-		n = re.sub('\+1', '', n)
-		n = re.sub(' ', '', n)
+		n = n.replace('+1', '')
+		n = n.replace(' ', '')
 					
 		if "(" in n or ")" in n:
-			n = re.sub('[(]',"", n)
-			n = re.sub('[)]','-',n)
-			n = re.sub(' ', '', n)
+			n = n.replace('(', '')
+			n = n.replace(')', '-')
 
 		if "+1" in n:
-			n = re.sub('\+1','',n)
-		if re.match(re.compile(r'\-\d{3}\-\d{3}\-\d{4}'),n) is not None:
+			n = n.replace('+1', '')
+		if phone_dash_prefix_re.match(n) is not None:
 			n = n[1:]
-		if re.match(re.compile(r'\d{1}\-\d{3}\-\d{3}\-\d{4}'),n) is not None:
+		if phone_country_re.match(n) is not None:
 			n = n[2:]
-		if re.match(re.compile(r'\d{9}'),n):
+		if phone_digits_re.match(n):
 			n = n[:3] + '-' + n[3:6] + '-' + n[6:] 
-		if re.match(re.compile(r'\d{6}\-\d{4}'),n):
+		if phone_six_four_re.match(n):
 			n = n[:3] + '-' + n[3:]
 
 	return n
 
 
+@cached_cleaner('county')
 def update_county(name):
 	""" 
 	Using regex to determine whether particular string has more than one county (separated by : or ;).
@@ -149,10 +233,10 @@ def update_county(name):
 			name = name.split(';')[0]
 	if "AL" in name:
 		name = "Fulton, GA"
-	print name
 	return name
 
 
+@cached_cleaner('postal')
 def update_postal(name):
 	"""Return first five digits of postal code"""
 
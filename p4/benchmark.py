@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the wrangling pipeline stage by stage on synthetic OSM data.
+
+    python benchmark.py --size 10MB --output bench.json
+    python benchmark.py --size 100MB --compare bench.json
+    python benchmark.py --size 100MB --node-share 0.95 --stages parse_etree parse_lxml parse_expat
+
+The generator writes a reproducible file whose tag keys, street suffixes, phone
+formats, postcodes and counties follow what we saw in the Atlanta sample. Each stage
+runs in its own process so its peak RSS is its own; results are saved as JSON and can
+be compared against an earlier run to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from multiprocessing import Process, Queue
+
+from audit import update_street, update_phone, update_postal, update_county
+import element_source
+import main
+
+SIZES = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+STREET_NAMES = ['Peachtree', 'Ponce de Leon', 'Piedmont', 'Memorial', 'Moreland', 'Spring',
+                'West Peachtree', 'North Highland', 'Howell Mill', 'Roswell', 'Buford',
+                'Briarcliff', 'Lawrenceville', 'Marietta', 'Cascade', 'oak grove', 'CHESHIRE BRIDGE']
+STREET_SUFFIXES = ['Street', 'Avenue', 'Road', 'Drive', 'Boulevard', 'Way', 'Circle', 'Court',
+                   'St', 'St.', 'Ave', 'Ave.', 'Rd', 'Dr', 'Blvd', 'Pkwy', 'Ln', 'Cir', 'Ct',
+                   'NE', 'NW', 'SE', 'SW', 'Hwy', 'Xing', 'Trce']
+PHONES = ['404-555-{0:04d}', '(404) 555-{0:04d}', '+1 404 555 {0:04d}', '+1-404-555-{0:04d}',
+          '4045550{0:03d}', '1-404-555-{0:04d}', '770.555.{0:04d}']
+POSTCODES = ['30303', '30305', '30306', '30308', '30309', '30312', '30318', '30324',
+             '30308-1234', 'GA 30305']
+COUNTIES = ['Fulton, GA', 'DeKalb, GA', 'Cobb, GA', 'Fulton, GA:DeKalb, GA',
+            'Clayton, GA;Fulton, GA', 'Cleburne, AL']
+AMENITIES = ['restaurant', 'fast_food', 'cafe', 'school', 'place_of_worship', 'bank',
+             'fuel', 'pharmacy', 'parking']
+CUISINES = ['american', 'mexican', 'pizza', 'burger', 'chinese', 'sandwich']
+HIGHWAYS = ['residential', 'service', 'footway', 'tertiary', 'secondary', 'primary']
+
+# Bounding box of the Atlanta extract
+BBOX = (33.6, -84.6, 34.0, -84.2)
+
+# Share of the file taken by nodes; the Atlanta extract is about 70%
+NODE_SHARE = 0.7
+
+# XML backend the pipeline stages parse with (--parser)
+BACKEND = element_source.DEFAULT_BACKEND
+
+
+# ================================================== #
+#               Synthetic OSM Generator              #
+# ================================================== #
+def parse_size(size):
+    size = size.upper()
+    for unit, factor in SIZES.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def _street(rng):
+    return '{0} {1}'.format(rng.choice(STREET_NAMES), rng.choice(STREET_SUFFIXES))
+
+
+def _node_tags(rng, i):
+    """About one node in six carries tags, like the Atlanta extract"""
+
+    if rng.random() > 0.16:
+        return []
+    tags = [('amenity', rng.choice(AMENITIES)), ('name', 'Place {0}'.format(i))]
+    if rng.random() < 0.5:
+        tags += [('addr:street', _street(rng)), ('addr:housenumber', str(rng.randint(1, 9999))),
+                 ('addr:postcode', rng.choice(POSTCODES)), ('addr:city', 'Atlanta'),
+                 ('addr:state', rng.choice(['GA', 'Ga', 'Georgia']))]
+    if rng.random() < 0.3:
+        tags.append(('phone', rng.choice(PHONES).format(rng.randint(0, 999))))
+    if tags[0][1] in ('restaurant', 'fast_food'):
+        tags.append(('cuisine', rng.choice(CUISINES)))
+    return tags
+
+
+def _way_tags(rng):
+    tags = [('highway', rng.choice(HIGHWAYS)), ('name', _street(rng))]
+    if rng.random() < 0.6:
+        tags += [('tiger:county', rng.choice(COUNTIES)), ('tiger:name_base', rng.choice(STREET_NAMES)),
+                 ('tiger:name_type', rng.choice(STREET_SUFFIXES)), ('tiger:reviewed', 'no'),
+                 ('tiger:zip_left', rng.choice(POSTCODES)[:5])]
+    if rng.random() < 0.05:
+        tags.append(('addr:street', _street(rng)))
+    return tags
+
+
+def _escape(value):
+    return value.replace('&', '&amp;').replace('"', '&quot;').replace('<', '&lt;')
+
+
+def generate(path, size, seed=0, node_share=NODE_SHARE):
+    """Write a synthetic OSM file of about size bytes: nodes first, then ways, like an extract"""
+
+    rng = random.Random(seed)
+    node_budget = int(size * node_share)
+    header = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<osm version="0.6" generator="benchmark.py">\n'
+              ' <bounds minlat="{0}" minlon="{1}" maxlat="{2}" maxlon="{3}"/>\n').format(*BBOX)
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        written = len(header)
+
+        node_id = 0
+        while written < node_budget:
+            node_id += 1
+            attrs = ' <node id="{0}" lat="{1:.7f}" lon="{2:.7f}" version="{3}" timestamp="2016-{4:02d}-01T12:00:00Z" ' \
+                    'changeset="{5}" uid="{6}" user="mapper{6}"'.format(
+                        node_id, rng.uniform(BBOX[0], BBOX[2]), rng.uniform(BBOX[1], BBOX[3]),
+                        rng.randint(1, 5), rng.randint(1, 12), rng.randint(1, 40000000), rng.randint(1, 2000))
+            tags = _node_tags(rng, node_id)
+            if tags:
+                lines = [attrs + '>\n'] + ['  <tag k="{0}" v="{1}"/>\n'.format(k, _escape(v)) for k, v in tags]
+                lines.append(' </node>\n')
+            else:
+                lines = [attrs + '/>\n']
+            chunk = ''.join(lines)
+            f.write(chunk)
+            written += len(chunk)
+
+        way_id = 1000000000
+        while written < size:
+            way_id += 1
+            lines = [' <way id="{0}" version="{1}" timestamp="2016-{2:02d}-01T12:00:00Z" changeset="{3}" '
+                     'uid="{4}" user="mapper{4}">\n'.format(way_id, rng.randint(1, 5), rng.randint(1, 12),
+                                                             rng.randint(1, 40000000), rng.randint(1, 2000))]
+            start = rng.randint(1, max(node_id - 30, 1))
+            lines += ['  <nd ref="{0}"/>\n'.format(start + j) for j in range(rng.randint(2, 25))]
+            lines += ['  <tag k="{0}" v="{1}"/>\n'.format(k, _escape(v)) for k, v in _way_tags(rng)]
+            lines.append(' </way>\n')
+            chunk = ''.join(lines)
+            f.write(chunk)
+            written += len(chunk)
+
+        f.write('</osm>\n')
+
+
+# ================================================== #
+#               Stages                               #
+# ================================================== #
+# Each stage takes the osm path and returns the number of items it processed.
+
+def stage_get_element(path):
+    return sum(1 for _ in main.get_element(path, tags=('node', 'way'), backend=BACKEND))
+
+
+def stage_shape_element(path):
+    count = 0
+    for element in main.get_element(path, tags=('node', 'way'), backend=BACKEND):
+        main.shape_element(element)
+        count += 1
+    return count
+
+
+def _tag_values(path):
+    """Raw values of the tags the cleaners run on, collected outside the timed section"""
+
+    values = {'street': [], 'phone': [], 'postcode': [], 'county': []}
+    for element in main.get_element(path, tags=('node', 'way'), backend=BACKEND):
+        for tag in element.iter('tag'):
+            key = tag.attrib['k']
+            sub_key = key.split(':', 1)[-1]
+            if key == 'phone':
+                values['phone'].append(tag.attrib['v'])
+            elif sub_key in values:
+                values[sub_key].append(tag.attrib['v'])
+    return values
+
+
+def stage_cleaners(path):
+    values = _tag_values(path)
+    street_issue = defaultdict(int)
+    start = time.time()
+    for value in values['street']:
+        update_street(value, street_issue)
+    for value in values['phone']:
+        update_phone(value)
+    for value in values['postcode']:
+        update_postal(value)
+    for value in values['county']:
+        update_county(value)
+    return sum(len(v) for v in values.itervalues()), time.time() - start
+
+
+def _shaped_batches(path):
+    """Shaped elements a VALIDATION_BATCH at a time, so only one batch is held at once"""
+
+    batch = []
+    for element in main.get_element(path, tags=('node', 'way'), backend=BACKEND):
+        batch.append(main.shape_element(element))
+        if len(batch) >= main.VALIDATION_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stage_validation(path):
+    count, elapsed = 0, 0.0
+    for batch in _shaped_batches(path):
+        start = time.time()
+        main.validate_elements(batch)
+        elapsed += time.time() - start
+        count += len(batch)
+    return count, elapsed
+
+
+def stage_csv_writers(path):
+    out_dir = tempfile.mkdtemp()
+    try:
+        files, writers = main.open_csv_writers(out_dir)
+        count, elapsed = 0, 0.0
+        for batch in _shaped_batches(path):
+            start = time.time()
+            main.write_rows(batch, writers)
+            elapsed += time.time() - start
+            count += len(batch)
+        start = time.time()
+        for writer in writers:
+            writer.flush()
+        for f in files:
+            f.close()
+        return count, elapsed + time.time() - start
+    finally:
+        for name in os.listdir(out_dir):
+            os.remove(os.path.join(out_dir, name))
+        os.rmdir(out_dir)
+
+
+def stage_process_map(path):
+    """Everything process_map does for the csv sink, validation on"""
+
+    counted = [0]
+
+    def elements():
+        for element in main.get_element(path, tags=('node', 'way'), backend=BACKEND):
+            counted[0] += 1
+            yield element
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        files, writers = main.open_csv_writers(out_dir)
+        main.write_elements(elements(), writers, validate=True)
+        for f in files:
+            f.close()
+        return counted[0]
+    finally:
+        for name in os.listdir(out_dir):
+            os.remove(os.path.join(out_dir, name))
+        os.rmdir(out_dir)
+
+
+def stage_parse(backend):
+    """Parse with one element_source backend, touching every child like shape_element does"""
+
+    def stage(path):
+        count = 0
+        for element in element_source.iter_elements(path, ('node', 'way'), backend):
+            for child in element:
+                child.attrib
+            count += 1
+        return count
+    return stage
+
+
+PARSE_STAGES = [('parse_' + backend, stage_parse(backend))
+                for backend in element_source.available_backends()]
+
+STAGES = [('get_element', stage_get_element),
+          ('shape_element', stage_shape_element),
+          ('cleaners', stage_cleaners),
+          ('validation', stage_validation),
+          ('csv_writers', stage_csv_writers),
+          ('process_map', stage_process_map)] + PARSE_STAGES
+
+
+# ================================================== #
+#               Harness                              #
+# ================================================== #
+def _run_stage(stage, path, queue):
+    start = time.time()
+    result = stage(path)
+    elapsed = time.time() - start
+
+    # Stages that need setup (collecting values, shaping) time only their own part
+    if isinstance(result, tuple):
+        result, elapsed = result
+    queue.put((result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_stage(stage, path):
+    """Run one stage in a fresh process and return its measurements"""
+
+    queue = Queue()
+    process = Process(target=_run_stage, args=(stage, path, queue))
+    process.start()
+    count, seconds, peak_rss_kb = queue.get()
+    process.join()
+
+    megabytes = os.path.getsize(path) / float(SIZES['MB'])
+    return {'items': count,
+            'seconds': round(seconds, 4),
+            'items_per_sec': round(count / seconds, 1) if seconds else None,
+            'mb_per_sec': round(megabytes / seconds, 3) if seconds else None,
+            'peak_rss_kb': peak_rss_kb}
+
+
+def run(path, stages=STAGES):
+    results = {}
+    for name, stage in stages:
+        results[name] = run_stage(stage, path)
+        print '{0:<15}{1:>12} items{2:>12.1f} items/s{3:>10.2f} MB/s{4:>10d} KB peak'.format(
+            name, results[name]['items'], results[name]['items_per_sec'] or 0,
+            results[name]['mb_per_sec'] or 0, results[name]['peak_rss_kb'])
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print throughput against a saved run; return the names of stages that regressed"""
+
+    regressions = []
+    for name, stats in sorted(results.items()):
+        old = baseline.get('stages', {}).get(name)
+        if not old or not old.get('items_per_sec') or not stats['items_per_sec']:
+            continue
+        ratio = stats['items_per_sec'] / old['items_per_sec']
+        flag = ''
+        if ratio < 1 - threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print '{0:<15}{1:>8.2f}x throughput{2:>8.2f}x peak RSS{3}'.format(
+            name, ratio, float(stats['peak_rss_kb']) / old['peak_rss_kb'], flag)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the p4 wrangling pipeline')
+    parser.add_argument('--size', default='10MB', help='synthetic file size, e.g. 10MB, 100MB, 1GB')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--node-share', type=float, default=NODE_SHARE,
+                        help='share of the generated file taken by nodes (default: 0.7)')
+    parser.add_argument('--parser', choices=element_source.available_backends(), default=BACKEND,
+                        help='XML backend for the pipeline stages')
+    parser.add_argument('--osm', help='benchmark this file instead of generating one')
+    parser.add_argument('--keep', action='store_true', help='keep the generated file')
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _ in STAGES])
+    parser.add_argument('--output', help='save results as JSON here')
+    parser.add_argument('--compare', metavar='JSON', help='compare against a saved run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='throughput drop that counts as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    BACKEND = args.parser
+    path = args.osm
+    generated = False
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), 'synthetic_{0}_{1}_{2}.osm'.format(
+            args.size, args.seed, args.node_share))
+        if not os.path.exists(path):
+            start = time.time()
+            generate(path, parse_size(args.size), args.seed, args.node_share)
+            generated = True
+            print 'Generated {0} in {1:.1f}s'.format(path, time.time() - start)
+
+    stages = [(name, stage) for name, stage in STAGES if not args.stages or name in args.stages]
+    results = {'meta': {'osm': os.path.basename(path),
+                        'bytes': os.path.getsize(path),
+                        'size': args.size if args.osm is None else None,
+                        'seed': args.seed,
+                        'node_share': args.node_share if args.osm is None else None,
+                        'parser': args.parser,
+                        'python': platform.python_version(),
+                        'machine': platform.machine(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'stages': run(path, stages)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results['stages'], json.load(f), args.threshold)
+
+    # Only the file this run generated; a cached one from an earlier --keep run stays
+    if generated and not args.keep:
+        os.remove(path)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar output: every table as one .npy file per column, strings dictionary encoded.
+
+    DIR/manifest.json               tables, their fields, row counts and column kinds
+    DIR/dictionaries/<column>.json  the distinct strings of a column, by code
+    DIR/<table>/<column>.npy        int64 / float64 / int32 codes / int64 epoch seconds
+
+Missing values are NULL_INT in integer and timestamp columns, NaN in float columns and
+MISSING_CODE in dictionary columns.
+
+String columns share one dictionary per column name across the tables, so 'key' has
+the same codes in nodes_tags, ways_tags and relations_tags, and 'user' in nodes, ways
+and relations. StoreWriter stands in for the csv writers (main.py --columnar DIR) and
+streams each column to disk; only the dictionaries are kept in memory. Timestamps,
+which are nearly unique per row, are stored as seconds instead of being encoded.
+
+Store memory-maps the columns back, so the usual questions are numpy operations on
+integer codes instead of string comparisons over every row:
+
+    store = Store('output/columnar')
+    unique_key(store)            most common tag keys
+    top_users(store)             most active users over nodes and ways
+    value_counts(store, 'amenity')
+
+Parquet would be the natural format where pyarrow is installed; these plain .npy
+files only need numpy.
+"""
+
+import argparse
+import calendar
+import datetime
+import json
+import os
+import shutil
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORMAT_VERSION = 2
+
+# Rows buffered per table before they are split into columns and appended to disk
+BATCH_SIZE = 10000
+
+# schema.py type -> (column kind, array typecode, numpy dtype)
+KINDS = {'integer': ('int', 'l', 'int64'),
+         'float': ('float', 'd', 'float64'),
+         'string': ('dict', 'i', 'int32')}
+
+# String columns that hold an OSM timestamp (2016-01-01T00:00:00Z)
+TIMESTAMP_FIELDS = ('timestamp',)
+TIME_KIND = ('time', 'l', 'int64')
+
+MISSING_CODE = -1
+NULL_INT = -2 ** 63
+NAN = float('nan')
+
+TAG_TABLES = ('nodes_tags', 'ways_tags', 'relations_tags')
+
+
+class ColumnarError(Exception):
+    pass
+
+
+def _require_numpy():
+    if np is None:
+        raise ColumnarError('The columnar format needs numpy')
+
+
+def to_epoch(timestamp):
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def from_epoch(seconds):
+    if seconds == NULL_INT:
+        return None
+    return datetime.datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Dictionary(object):
+    """Distinct strings of one column in first-seen order; the position is the code"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if value is None:
+            return MISSING_CODE
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnWriter(object):
+    """Appends batches of one column to a raw file; close() turns it into a .npy"""
+
+    def __init__(self, path, kind, typecode, dtype, dictionary=None):
+        self.path = path
+        self.kind = kind
+        self.typecode = typecode
+        self.dtype = dtype
+        self.dictionary = dictionary
+        self.raw = open(path + '.raw', 'wb')
+        self.rows = 0
+
+    def write(self, values):
+        if self.kind == 'dict':
+            encode = self.dictionary.encode
+            values = [encode(value) for value in values]
+        elif self.kind == 'float':
+            values = [NAN if value is None or value == '' else float(value) for value in values]
+        elif self.kind == 'time':
+            values = [NULL_INT if value is None or value == '' else to_epoch(value) for value in values]
+        else:
+            values = [NULL_INT if value is None or value == '' else int(value) for value in values]
+        array(self.typecode, values).tofile(self.raw)
+        self.rows += len(values)
+
+    def close(self):
+        self.raw.close()
+        with open(self.path, 'wb') as f:
+            np.lib.format.write_array_header_1_0(
+                f, {'descr': np.dtype(self.dtype).str, 'fortran_order': False, 'shape': (self.rows,)})
+            with open(self.path + '.raw', 'rb') as raw:
+                shutil.copyfileobj(raw, f)
+        os.remove(self.path + '.raw')
+
+
+class TableWriter(object):
+    """
+    Writer for row tuples (fields order), with the interface of main.UnicodeWriter.
+    Rows are buffered and split into their columns a batch at a time.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = []
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            for column, values in zip(self.columns, zip(*self.rows)):
+                column.write(values)
+            self.rows = []
+
+
+class StoreWriter(object):
+    """
+    Owns one columnar output directory. tables is a list of (table, schema key, fields)
+    as for database.BulkLoader; writers come back in the same order.
+    """
+
+    def __init__(self, directory, tables, schema):
+        _require_numpy()
+        self.directory = directory
+        self.dictionaries = {}
+        self.manifest = {'version': FORMAT_VERSION, 'tables': {}}
+        self.columns = []
+        self.writers = []
+
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(os.path.join(directory, 'dictionaries'))
+
+        for table, key, fields in tables:
+            field_schema = schema[key]['schema']
+            if schema[key]['type'] == 'list':
+                field_schema = field_schema['schema']
+            os.makedirs(os.path.join(directory, table))
+
+            columns, kinds = [], {}
+            for field in fields:
+                if field in TIMESTAMP_FIELDS:
+                    kind, typecode, dtype = TIME_KIND
+                else:
+                    kind, typecode, dtype = KINDS[field_schema[field]['type']]
+                dictionary = self.dictionaries.setdefault(field, Dictionary()) if kind == 'dict' else None
+                columns.append(ColumnWriter(os.path.join(directory, table, field + '.npy'),
+                                            kind, typecode, dtype, dictionary))
+                kinds[field] = kind
+            self.columns.append((table, columns))
+            self.manifest['tables'][table] = {'fields': list(fields), 'kinds': kinds}
+            self.writers.append(TableWriter(columns))
+
+    def close(self):
+        for writer in self.writers:
+            writer.flush()
+        for table, columns in self.columns:
+            for column in columns:
+                column.close()
+            self.manifest['tables'][table]['rows'] = columns[0].rows if columns else 0
+
+        for field, dictionary in self.dictionaries.iteritems():
+            with open(os.path.join(self.directory, 'dictionaries', field + '.json'), 'w') as f:
+                json.dump(dictionary.values, f)
+        with open(os.path.join(self.directory, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+    def abort(self):
+        """Release the column files after a failure (no manifest is written); a no-op after close()"""
+
+        for _, columns in self.columns:
+            for column in columns:
+                column.raw.close()
+
+
+class Table(object):
+    """Columns of one table, memory-mapped on first use"""
+
+    def __init__(self, store, name, info):
+        self.store = store
+        self.name = name
+        self.fields = info['fields']
+        self.kinds = info['kinds']
+        self.rows = info['rows']
+        self.arrays = {}
+
+    def __getitem__(self, column):
+        if column not in self.arrays:
+            if column not in self.kinds:
+                raise KeyError('{0} has no column {1}'.format(self.name, column))
+            self.arrays[column] = np.load(os.path.join(self.store.directory, self.name, column + '.npy'),
+                                          mmap_mode='r')
+        return self.arrays[column]
+
+    def __len__(self):
+        return self.rows
+
+
+class Store(object):
+    """Reader for a StoreWriter directory"""
+
+    def __init__(self, directory):
+        _require_numpy()
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != FORMAT_VERSION:
+            raise ColumnarError('{0} is columnar format {1}, expected {2}'.format(
+                directory, manifest.get('version'), FORMAT_VERSION))
+        self.tables = dict((name, Table(self, name, info)) for name, info in manifest['tables'].iteritems())
+        self.dictionaries = {}
+        self.lookups = {}
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+    def dictionary(self, column):
+        if column not in self.dictionaries:
+            with open(os.path.join(self.directory, 'dictionaries', column + '.json')) as f:
+                self.dictionaries[column] = json.load(f)
+        return self.dictionaries[column]
+
+    def code(self, column, value):
+        """Code of value in a string column, MISSING_CODE if it never occurs"""
+
+        if column not in self.lookups:
+            self.lookups[column] = dict((v, i) for i, v in enumerate(self.dictionary(column)))
+        return self.lookups[column].get(value, MISSING_CODE)
+
+    def decode(self, column, codes):
+        values = self.dictionary(column)
+        return [values[code] if code != MISSING_CODE else None for code in codes]
+
+    def counts(self, column, tables, mask=None):
+        """Occurrences of each code of a string column summed over tables (bincount)"""
+
+        total = np.zeros(len(self.dictionary(column)), dtype=np.int64)
+        for name in tables:
+            if name not in self.tables:
+                continue
+            codes = self.tables[name][column]
+            if mask is not None:
+                codes = codes[mask(self.tables[name])]
+            codes = codes[codes != MISSING_CODE]
+            total += np.bincount(codes, minlength=len(total))
+        return total
+
+    def top(self, column, counts, k):
+        """The k most common (value, count) pairs from counts()"""
+
+        order = np.argsort(-counts, kind='mergesort')[:k]
+        return [(value, int(count)) for value, count in zip(self.decode(column, order), counts[order])
+                if count]
+
+
+# ================================================== #
+#               Queries                              #
+# ================================================== #
+def unique_key(store, k=20, tables=TAG_TABLES):
+    """Most common tag keys (analysis.unique_key on the converted data)"""
+
+    return store.top('key', store.counts('key', tables), k)
+
+
+def top_users(store, k=10, tables=('nodes', 'ways')):
+    """Users with the most nodes and ways"""
+
+    return store.top('user', store.counts('user', tables), k)
+
+
+def unique_users(store, tables=('nodes', 'ways')):
+    return int(np.count_nonzero(store.counts('user', tables)))
+
+
+def value_counts(store, key, k=20, tables=TAG_TABLES):
+    """Most common values of one tag key, e.g. 'amenity' or 'cuisine'"""
+
+    code = store.code('key', key)
+    return store.top('value', store.counts('value', tables, mask=lambda table: table['key'] == code), k)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query a columnar output directory')
+    parser.add_argument('directory')
+    parser.add_argument('query', choices=['unique_key', 'top_users', 'unique_users', 'value_counts'])
+    parser.add_argument('key', nargs='?', help='tag key for value_counts')
+    parser.add_argument('-k', type=int, default=20)
+    args = parser.parse_args()
+
+    store = Store(args.directory)
+    start = time.time()
+    if args.query == 'unique_key':
+        result = unique_key(store, args.k)
+    elif args.query == 'top_users':
+        result = top_users(store, args.k)
+    elif args.query == 'unique_users':
+        result = unique_users(store)
+    else:
+        if not args.key:
+            parser.error('value_counts needs a tag key')
+        result = value_counts(store, args.key, args.k)
+    seconds = time.time() - start
+
+    if isinstance(result, list):
+        for value, count in result:
+            print u'{0}\t{1}'.format(value, count).encode('utf-8')
+    else:
+        print result
+    print '{0:.2f} ms'.format(seconds * 1000)
@@ -1,27 +1,165 @@
-import xml.etree.cElementTree as ET  # Use cElementTree or lxml if too slow
+"""
+Build a sample of an OSM file by copying the raw bytes of selected top level elements.
+
+Elements are never parsed into ElementTree objects or re-serialized; the file is scanned
+line by line (one element start per line, which is how the metro extracts are written)
+and the few attributes needed for selection are read from the start tags with a small
+attribute parser, whatever their order or quoting.
+
+Sampling reads the file once. --complete-ways reads it a second time: the nodes of an
+extract come before its ways, so the nodes a sampled way needs have already gone by
+when the way is read.
+
+    python create_sample.py                       # every 28th element, as before
+    python create_sample.py --reservoir 50000 --seed 1
+    python create_sample.py --bbox 33.74 -84.40 33.79 -84.36 --complete-ways
+"""
+
+import argparse
+import random
+import re
+
+from element_source import iter_spans
 
 OSM_FILE = "./input/atlanta_ga.osm"  # Replace this with your osm file
 SAMPLE_FILE = "./input/sample2.osm"
 
 k = 28 # Parameter: take every k-th top level element
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
+# A start tag with its name="value" or name='value' attributes, in any order
+START_TAG_RE = re.compile(r'''<([\w:]+)((?:\s+[\w:.-]+\s*=\s*(?:"[^"]*"|'[^']*'))*)\s*/?>''')
+ATTRIBUTE_RE = re.compile(r'''([\w:.-]+)\s*=\s*("[^"]*"|'[^']*')''')
+
+
+def start_tags(raw):
+    """(tag, attributes) of every start tag in raw, the element itself first"""
+
+    for match in START_TAG_RE.finditer(raw):
+        yield match.group(1), dict((name, value[1:-1]) for name, value in ATTRIBUTE_RE.findall(match.group(2)))
+
+
+def element_attrib(raw):
+    return next(start_tags(raw))[1]
+
+
+def element_id(raw):
+    return element_attrib(raw)['id']
+
+
+def child_attribs(raw, tag):
+    return [attrib for child, attrib in start_tags(raw) if child == tag]
+
+
+def in_bbox(attrib, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return ('lat' in attrib and 'lon' in attrib and
+            min_lat <= float(attrib['lat']) <= max_lat and
+            min_lon <= float(attrib['lon']) <= max_lon)
+
+
+# Each select_* takes the (tag, raw) spans of the file and returns the selected
+# (index, tag, raw) in file order
+
+def select_every(spans, k):
+    """Every k-th top level element"""
+
+    return ((i, tag, raw) for i, (tag, raw) in enumerate(spans) if i % k == 0)
+
+
+def select_reservoir(spans, size, seed):
+    """A uniform random sample of size elements (reservoir sampling), held in memory until the end"""
+
+    rng = random.Random(seed)
+    reservoir = []
+    for i, (tag, raw) in enumerate(spans):
+        if i < size:
+            reservoir.append((i, tag, raw))
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                reservoir[j] = (i, tag, raw)
+    reservoir.sort()
+    return reservoir
+
+
+def select_bbox(spans, bbox):
+    """
+    Nodes inside bbox, ways with at least one of those nodes and relations with at
+    least one selected member. A member can be a node, a way or another relation.
+    This is a single pass, so a relation member counts only when it comes earlier
+    in the file. Extracts list relations by id, and super-relations (route masters)
+    usually come after their members.
+    """
+
+    ids = {'node': set(), 'way': set(), 'relation': set()}
+    for i, (tag, raw) in enumerate(spans):
+        if tag == 'node':
+            keep = in_bbox(element_attrib(raw), bbox)
+        elif tag == 'way':
+            keep = any(nd.get('ref') in ids['node'] for nd in child_attribs(raw, 'nd'))
+        else:
+            keep = any(member.get('ref') in ids.get(member.get('type'), ())
+                       for member in child_attribs(raw, 'member'))
+
+        if keep:
+            if tag in ids:
+                ids[tag].add(element_id(raw))
+            yield i, tag, raw
+
+
+def with_referenced_nodes(osm_file, selected):
+    """The selected elements plus every node referenced by a selected way, in file order"""
+
+    indexes = set()
+    refs = set()
+    for i, tag, raw in selected:
+        indexes.add(i)
+        if tag == 'way':
+            refs.update(nd.get('ref') for nd in child_attribs(raw, 'nd'))
+
+    for i, (tag, raw) in enumerate(iter_spans(osm_file)):
+        if i in indexes or (tag == 'node' and element_id(raw) in refs):
+            yield i, tag, raw
+
+
+def write_sample(sample_file, selected):
+    """Copy the raw bytes of the selected elements"""
+
+    with open(sample_file, 'wb') as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write('<osm>\n')
+
+        for _, _, raw in selected:
+            output.write(raw)
 
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+        output.write('</osm>\n')
 
 
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write('<osm>\n  ')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sample an OSM file')
+    parser.add_argument('--input', default=OSM_FILE)
+    parser.add_argument('--output', default=SAMPLE_FILE)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--every', type=int, default=k, metavar='K',
+                      help='take every k-th top level element (default: %(default)s)')
+    mode.add_argument('--reservoir', type=int, metavar='N',
+                      help='take a uniform random sample of N elements')
+    mode.add_argument('--bbox', type=float, nargs=4,
+                      metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'),
+                      help='take everything inside a bounding box')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for --reservoir')
+    parser.add_argument('--complete-ways', action='store_true',
+                        help='also include every node referenced by a sampled way')
+    args = parser.parse_args()
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
+    spans = iter_spans(args.input)
+    if args.reservoir is not None:
+        selected = select_reservoir(spans, args.reservoir, args.seed)
+    elif args.bbox is not None:
+        selected = select_bbox(spans, args.bbox)
+    else:
+        selected = select_every(spans, args.every)
 
-    output.write('</osm>')
\ No newline at end of file
+    if args.complete_ways:
+        selected = with_referenced_nodes(args.input, selected)
+    write_sample(args.output, selected)
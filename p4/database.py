@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk load shaped OSM elements straight into SQLite instead of going through csv files.
+
+Tables follow schema.py: one column per field, typed from the schema's 'type' rule.
+Keys and indexes are created after the load so inserts only append to the tables,
+along with the spatial index (spatial.py).
+"""
+
+import sqlite3
+
+import geometry
+import spatial
+
+SQL_TYPES = {'integer': 'INTEGER', 'float': 'REAL', 'string': 'TEXT'}
+
+# Rows buffered per table before an executemany, and rows per transaction
+BATCH_SIZE = 10000
+TRANSACTION_ROWS = 500000
+
+# Safe for a database we rebuild from scratch: nothing to recover if the load dies
+BULK_PRAGMAS = ['PRAGMA journal_mode = OFF',
+                'PRAGMA synchronous = OFF',
+                'PRAGMA locking_mode = EXCLUSIVE',
+                'PRAGMA temp_store = MEMORY',
+                'PRAGMA cache_size = -200000']
+
+# Incremental runs change a database we keep, so they leave journal and sync alone
+APPEND_PRAGMAS = ['PRAGMA temp_store = MEMORY',
+                  'PRAGMA cache_size = -200000']
+
+# Tables holding the rows of each element type, for deletes in incremental runs
+ELEMENT_TABLES = {'node': ['nodes', 'nodes_tags'],
+                  'way': ['ways', 'ways_tags', 'ways_nodes'],
+                  'relation': ['relations', 'relations_tags', 'relations_members']}
+
+# (table, column, unique) created once the load is finished
+INDEXES = [('nodes', 'id', True),
+           ('ways', 'id', True),
+           ('nodes_tags', 'id', False),
+           ('ways_tags', 'id', False),
+           ('ways_nodes', 'id', False),
+           ('ways_nodes', 'node_id', False),
+           ('relations', 'id', True),
+           ('relations_tags', 'id', False),
+           ('relations_members', 'id', False),
+           ('relations_members', 'member_id', False)]
+
+
+def create_table_sql(table, fields, field_schema):
+    """Return a CREATE TABLE statement with columns in fields order, typed from schema.py"""
+
+    columns = ['{0} {1}'.format(field, SQL_TYPES[field_schema[field]['type']])
+               for field in fields]
+    return 'CREATE TABLE {0} ({1})'.format(table, ', '.join(columns))
+
+
+class TableWriter(object):
+    """Buffer row tuples (fields order) for one table and insert them with executemany"""
+
+    def __init__(self, loader, table, fields):
+        self.loader = loader
+        self.fields = fields
+        self.rows = []
+        self.sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            table, ', '.join(fields), ', '.join('?' * len(fields)))
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.loader.execute_batch(self.sql, self.rows)
+            self.rows = []
+
+
+class NodeTable(object):
+    """Node locations read back from the nodes table, with the get() of geometry.NodeLocations"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, node_id):
+        row = self.conn.execute('SELECT lat, lon FROM nodes WHERE id = ?', (node_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return geometry.to_fixed(row[0]), geometry.to_fixed(row[1])
+
+
+class BulkLoader(object):
+    """
+    Owns the connection for one load. tables is a list of (table, schema key, fields);
+    writers are returned in the same order so they can stand in for the csv writers.
+    With append=True the existing tables and indexes are kept, for incremental runs,
+    and the whole delta is applied in one transaction so a failed run changes nothing.
+    """
+
+    def __init__(self, db_path, tables, schema, append=False):
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        self.append = append
+        self.pending = 0
+        self.deletes = dict((element_type, []) for element_type in ELEMENT_TABLES)
+        self.changed = dict((element_type, set()) for element_type in ELEMENT_TABLES)
+
+        for pragma in APPEND_PRAGMAS if append else BULK_PRAGMAS:
+            self.conn.execute(pragma)
+
+        if append:
+            existing = set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            missing = [table for table, _, _ in tables if table not in existing]
+            if missing:
+                self.conn.close()
+                raise ValueError('{0} lacks the tables {1} (built by an older version); rebuild required: '
+                                 'delete the --incremental index and run again'.format(db_path, ', '.join(missing)))
+
+        for table, key, fields in tables:
+            if append:
+                break
+            field_schema = schema[key]['schema']
+            if schema[key]['type'] == 'list':
+                field_schema = field_schema['schema']
+            self.conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+            self.conn.execute(create_table_sql(table, fields, field_schema))
+
+        self.writers = [TableWriter(self, table, fields) for table, _, fields in tables]
+        self.conn.execute('BEGIN')
+
+    def record(self, element_type, element_id, action):
+        """
+        Change sink for incremental runs: drop any old rows of the element. Inserts are
+        included, so rows an earlier interrupted run left behind are not duplicated.
+        """
+
+        self.deletes[element_type].append((element_id,))
+        self.changed[element_type].add(int(element_id))
+
+    def flush_deletes(self):
+        for element_type, ids in self.deletes.iteritems():
+            if ids:
+                for table in ELEMENT_TABLES[element_type]:
+                    self.conn.executemany('DELETE FROM {0} WHERE id = ?'.format(table), ids)
+                del ids[:]
+
+    def update_way_geometry(self):
+        """
+        Recompute the geometry columns of the changed ways and of every way that uses a
+        changed node, from the nodes table as it is after this delta. Call before close().
+        """
+
+        if not set(geometry.GEOMETRY_FIELDS) <= spatial.table_columns(self.conn, 'ways'):
+            return
+        for writer in self.writers:
+            writer.flush()
+        self.flush_deletes()
+
+        way_ids = set(self.changed['way'])
+        for node_id in self.changed['node']:
+            way_ids.update(row[0] for row in self.conn.execute(
+                'SELECT id FROM ways_nodes WHERE node_id = ?', (node_id,)))
+
+        nodes = NodeTable(self.conn)
+        updates = []
+        for way_id in sorted(way_ids):
+            refs = [row[0] for row in self.conn.execute(
+                'SELECT node_id FROM ways_nodes WHERE id = ? ORDER BY position', (way_id,))]
+            if refs:
+                updates.append(geometry.way_geometry(nodes, refs) + (way_id,))
+        self.conn.executemany('UPDATE ways SET {0} WHERE id = ?'.format(
+            ', '.join(field + ' = ?' for field in geometry.GEOMETRY_FIELDS)), updates)
+
+    def execute_batch(self, sql, rows):
+        # Old rows must be gone before the new version of an element is inserted
+        self.flush_deletes()
+        self.conn.executemany(sql, rows)
+        self.pending += len(rows)
+        if self.pending >= TRANSACTION_ROWS and not self.append:
+            self.conn.execute('COMMIT')
+            self.conn.execute('BEGIN')
+            self.pending = 0
+
+    def close(self):
+        """Flush buffered rows, commit, then build the indexes, spatial index and table statistics"""
+
+        for writer in self.writers:
+            writer.flush()
+        self.flush_deletes()
+        self.conn.execute('COMMIT')
+
+        if self.append:
+            self.conn.close()
+            return
+
+        for table, column, unique in INDEXES:
+            self.conn.execute('CREATE {0}INDEX {1}_{2}_idx ON {1} ({2})'.format(
+                'UNIQUE ' if unique else '', table, column))
+        spatial.create_index(self.conn)
+        self.conn.execute('ANALYZE')
+        self.conn.close()
+
+    def abort(self):
+        """Close without committing after a failure, so an append run changes nothing; a no-op after close()"""
+
+        self.conn.close()
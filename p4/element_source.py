@@ -0,0 +1,211 @@
+"""
+Element sources for OSM files, shared by main.py, audit.py and create_sample.py.
+
+iter_elements(osm_file, tags, backend) yields the top level elements whose tag is in
+tags, one at a time, each with .tag, .attrib, its children when iterated and .iter(tag).
+Backends:
+
+    etree   xml.etree.cElementTree iterparse; yields Elements, clearing the root as it goes
+    lxml    lxml.etree iterparse with a tag filter, so only the wanted end events reach
+            Python (optional, used when lxml is installed)
+    expat   xml.parsers.expat push parser fed 64KB at a time; yields Record objects
+            (tag, attrib, children) without building an ElementTree at all
+
+osm_file can be a path or anything with read(). iter_spans() is the raw byte source:
+it copies elements out of the file without parsing them.
+"""
+
+from collections import OrderedDict
+import re
+import xml.etree.cElementTree as ET
+from xml.parsers import expat
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+TOP_LEVEL = ('node', 'way', 'relation')
+CHUNK_SIZE = 65536
+
+
+class Record(list):
+    """
+    Lightweight stand-in for an Element: a list of child records with tag and attrib.
+    Subclassing list keeps creation and iteration in C.
+    """
+
+    __slots__ = ('tag', 'attrib')
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self:
+            for element in child.iter(tag):
+                yield element
+
+
+def _record(tag, attrib):
+    record = Record()
+    record.tag = tag
+    record.attrib = attrib
+    return record
+
+
+NON_ASCII = re.compile(r'[\x80-\xff]')
+LAST_NON_ASCII = re.compile(r'.*[\x80-\xff]', re.S)
+
+
+def last_non_ascii_byte(data):
+    """
+    Offset in data of the last byte that can make a parsed value non-ASCII: UTF-8
+    text, or a character reference (&#233;) in ASCII text, including one cut by the
+    end of data. -1 if there is none.
+    """
+    last = data.rfind('&#')
+    if data.endswith('&'):
+        last = len(data) - 1
+    if NON_ASCII.search(data) is not None:
+        last = max(last, LAST_NON_ASCII.match(data).end() - 1)
+    return last
+
+
+def _utf8_value(value):
+    """cElementTree gives str for ASCII values and unicode otherwise; match it"""
+    try:
+        value.decode('ascii')
+        return value
+    except UnicodeDecodeError:
+        return value.decode('utf-8')
+
+
+def _utf8_attrib(attrs):
+    return dict((_utf8_value(k), _utf8_value(v)) for k, v in attrs.iteritems())
+
+
+def iter_etree(osm_file, tags=TOP_LEVEL):
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def iter_lxml(osm_file, tags=TOP_LEVEL):
+    if lxml_etree is None:
+        raise ImportError('the lxml backend needs lxml installed')
+
+    # Every top level element ends here, matched or not, so the ones the caller
+    # skips are dropped as well instead of piling up under the root
+    wanted = frozenset(tags)
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',), tag=tuple(wanted.union(TOP_LEVEL))):
+        if elem.tag in wanted:
+            yield elem
+        # Drop the element and the already processed siblings the tree still holds
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def iter_expat(osm_file, tags=TOP_LEVEL, chunk_size=CHUNK_SIZE):
+    tags = frozenset(tags)
+    done = []
+    stack = []
+    # expat hands out UTF-8 byte strings. A start tag at or before the offset of the
+    # last byte that could produce a non-ASCII value has each of its values checked
+    # and decoded on its own; the values of a tag after it are all ASCII. checking
+    # is off while every tag still to come starts after that byte
+    last_non_ascii = [-1]
+    checking = [False]
+
+    def start(name, attrs):
+        if stack:
+            record = Record()
+            record.tag = name
+            record.attrib = (_utf8_attrib(attrs) if checking[0] and last_non_ascii[0] >= parser.CurrentByteIndex
+                             else attrs)
+            stack[-1].append(record)
+            stack.append(record)
+        elif name in tags:
+            if checking[0] and last_non_ascii[0] >= parser.CurrentByteIndex:
+                attrs = _utf8_attrib(attrs)
+            stack.append(_record(name, attrs))
+
+    def end(name):
+        if stack:
+            record = stack.pop()
+            if not stack:
+                done.append(record)
+
+    parser = expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+
+    opened = not hasattr(osm_file, 'read')
+    f = open(osm_file, 'rb') if opened else osm_file
+    offset = 0
+    try:
+        while True:
+            data = f.read(chunk_size)
+            last = last_non_ascii_byte(data)
+            if last >= 0:
+                last_non_ascii[0] = offset + last
+                checking[0] = True
+            offset += len(data)
+            parser.Parse(data, not data)
+            # Tags reported by the next Parse start at or after the unfinished one
+            checking[0] = last_non_ascii[0] >= parser.CurrentByteIndex
+            for record in done:
+                yield record
+            del done[:]
+            if not data:
+                break
+    finally:
+        if opened:
+            f.close()
+
+
+BACKENDS = OrderedDict([('etree', iter_etree), ('lxml', iter_lxml), ('expat', iter_expat)])
+DEFAULT_BACKEND = 'etree'
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != 'lxml' or lxml_etree is not None]
+
+
+def iter_elements(osm_file, tags=TOP_LEVEL, backend=DEFAULT_BACKEND):
+    """Yield the top level elements of osm_file whose tag is in tags"""
+    return BACKENDS[backend](osm_file, tags)
+
+
+def iter_spans(osm_file, tags=TOP_LEVEL):
+    """
+    Yield (tag, raw bytes) for every top level element in tags, in file order.
+    Assumes one element start per line, which is how the metro extracts are written.
+    """
+
+    with open(osm_file, 'rb') as f:
+        for line in f:
+            stripped = line.lstrip()
+            if not stripped.startswith('<'):
+                continue
+            tag = stripped[1:].split(None, 1)[0].rstrip('/>')
+            if tag not in tags:
+                continue
+
+            if stripped.rstrip().endswith('/>'):
+                yield tag, line
+                continue
+
+            lines = [line]
+            end_tag = '</{0}>'.format(tag)
+            for line in f:
+                lines.append(line)
+                if line.strip() == end_tag:
+                    break
+            yield tag, ''.join(lines)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Node locations kept while nodes stream past, and the way geometry computed from them.
+
+Coordinates are stored as 1e-7 degree fixed point integers, the precision OSM uses:
+
+    NodeLocations       sorted id array plus lat/lon arrays, 16 bytes a node in RAM,
+                        looked up with bisect. Fine for metro extracts. Input that is
+                        not sorted by id, or more than MEMORY_NODES nodes, moves it
+                        to a FlatNodeLocations in a temporary file, so RAM use stays
+                        bounded without having to pass --flat-nodes.
+    FlatNodeLocations   a memory-mapped file indexed by node id, 8 bytes per possible
+                        id. The file is sparse and the OS pages it, so RAM stays bounded
+                        for full-state extracts with tens of millions of nodes, and the
+                        file can be kept between incremental runs. Negative ids
+                        (editor placeholders) go in a dict for the run instead.
+
+way_geometry() turns a way's node refs into centroid, bounding box and length columns.
+"""
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from itertools import islice, izip
+
+# Fixed-width signed 64 bit ids, as in incremental.py
+ID_ARRAY_TYPE = 'l'
+COORD_ARRAY_TYPE = 'i'
+
+SCALE = 10000000
+# Nodes kept in the in-memory arrays (about 320MB) before they move to a flat file
+MEMORY_NODES = 20000000
+EARTH_RADIUS_M = 6371008.8
+
+# Columns added to each way row, in this order
+GEOMETRY_FIELDS = ['centroid_lat', 'centroid_lon', 'min_lat', 'min_lon', 'max_lat', 'max_lon',
+                   'length_m']
+NO_GEOMETRY = (None,) * len(GEOMETRY_FIELDS)
+
+
+def to_fixed(degrees):
+    return int(round(float(degrees) * SCALE))
+
+
+class NodeLocations(object):
+    """Sorted in-memory arrays of node id, lat and lon"""
+
+    def __init__(self):
+        self.ids = array(ID_ARRAY_TYPE)
+        self.lats = array(COORD_ARRAY_TYPE)
+        self.lons = array(COORD_ARRAY_TYPE)
+        self.flat = None
+
+    def add(self, node_id, lat, lon):
+        self.put(int(node_id), to_fixed(lat), to_fixed(lon))
+
+    def put(self, node_id, lat, lon):
+        """Store a location already in fixed point"""
+
+        if self.flat is not None:
+            return self.flat.put(node_id, lat, lon)
+        if (self.ids and node_id <= self.ids[-1]) or len(self.ids) >= MEMORY_NODES:
+            self.spill()
+            return self.flat.put(node_id, lat, lon)
+        self.ids.append(node_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def extend(self, ids, lats, lons):
+        """Store arrays of ids and fixed point locations, e.g. the nodes of one range of a parallel run"""
+
+        if (self.flat is None and ids and (not self.ids or ids[0] > self.ids[-1]) and
+                len(self.ids) + len(ids) <= MEMORY_NODES and
+                all(a < b for a, b in izip(ids, islice(ids, 1, None)))):
+            self.ids.extend(ids)
+            self.lats.extend(lats)
+            self.lons.extend(lons)
+            return
+        for node_id, lat, lon in izip(ids, lats, lons):
+            self.put(node_id, lat, lon)
+
+    def spill(self):
+        """Move to a flat file, for input not sorted by id or too large for the arrays"""
+
+        fd, path = tempfile.mkstemp(suffix='.nodes')
+        os.close(fd)
+        self.flat = FlatNodeLocations(path)
+        for node_id, lat, lon in izip(self.ids, self.lats, self.lons):
+            self.flat.put(node_id, lat, lon)
+        self.ids = array(ID_ARRAY_TYPE)
+        self.lats = array(COORD_ARRAY_TYPE)
+        self.lons = array(COORD_ARRAY_TYPE)
+
+    def get(self, node_id):
+        """(lat, lon) in fixed point, or None for a node we have not seen"""
+
+        if self.flat is not None:
+            return self.flat.get(node_id)
+        ids = self.ids
+        node_id = int(node_id)
+        i = bisect.bisect_left(ids, node_id)
+        if i < len(ids) and ids[i] == node_id:
+            return self.lats[i], self.lons[i]
+        return None
+
+    def close(self):
+        if self.flat is not None:
+            self.flat.close()
+            os.remove(self.flat.path)
+            self.flat = None
+
+
+class FlatNodeLocations(object):
+    """
+    Dense memory-mapped store: the record of node id n is at byte 8 * n. Values are
+    offset to be unsigned so that an all zero (never written) record means missing.
+    Negative ids have no record; they are kept in self.negative, not in the file.
+    """
+
+    RECORD = struct.Struct('<II')
+    OFFSET = 1800000001
+    GROW = 64 * 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self.f.fileno()).st_size == 0:
+            self.f.truncate(self.GROW)
+        self.map = mmap.mmap(self.f.fileno(), 0)
+        self.negative = {}
+
+    def add(self, node_id, lat, lon):
+        self.put(int(node_id), to_fixed(lat), to_fixed(lon))
+
+    def put(self, node_id, lat, lon):
+        """Store a location already in fixed point"""
+
+        if node_id < 0:
+            self.negative[node_id] = (lat, lon)
+            return
+        offset = node_id * self.RECORD.size
+        if offset + self.RECORD.size > len(self.map):
+            size = max(offset + self.RECORD.size, 2 * len(self.map))
+            self.map.resize(size + (-size % mmap.PAGESIZE))
+        self.RECORD.pack_into(self.map, offset, lat + self.OFFSET, lon + self.OFFSET)
+
+    def extend(self, ids, lats, lons):
+        for node_id, lat, lon in izip(ids, lats, lons):
+            self.put(node_id, lat, lon)
+
+    def get(self, node_id):
+        node_id = int(node_id)
+        if node_id < 0:
+            return self.negative.get(node_id)
+        offset = node_id * self.RECORD.size
+        if offset + self.RECORD.size > len(self.map):
+            return None
+        lat, lon = self.RECORD.unpack_from(self.map, offset)
+        if lat == 0:
+            return None
+        return lat - self.OFFSET, lon - self.OFFSET
+
+    def close(self):
+        self.map.close()
+        self.f.close()
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    """Haversine distance between two points given in radians"""
+
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great circle distance in metres between two points given in degrees"""
+
+    return _distance_m(math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2))
+
+
+def way_geometry(node_locations, refs):
+    """
+    (centroid_lat, centroid_lon, min_lat, min_lon, max_lat, max_lon, length_m) for a way.
+    Nodes missing from the store (outside the extract) are skipped; a way with none of
+    its nodes gets NO_GEOMETRY. The closing node of a closed way (first ref equal to
+    the last) is not counted twice in the centroid.
+    """
+
+    located = [node_locations.get(ref) for ref in refs]
+    points = [p for p in located if p is not None]
+    if not points:
+        return NO_GEOMETRY
+
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    if len(refs) > 1 and refs[0] == refs[-1]:
+        located = located[:-1]
+    vertices = [p for p in located if p is not None]
+
+    radians = [(math.radians(lat / float(SCALE)), math.radians(lon / float(SCALE))) for lat, lon in points]
+    length = sum(_distance_m(a[0], a[1], b[0], b[1]) for a, b in izip(radians, islice(radians, 1, None)))
+
+    return (round(sum(lat for lat, _ in vertices) / float(len(vertices) * SCALE), 7),
+            round(sum(lon for _, lon in vertices) / float(len(vertices) * SCALE), 7),
+            min(lats) / float(SCALE), min(lons) / float(SCALE),
+            max(lats) / float(SCALE), max(lons) / float(SCALE),
+            round(length, 2))
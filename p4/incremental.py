@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental conversion driven by element (id, version).
+
+A VersionIndex from the previous run holds every node, way and relation id with its
+version in sorted fixed-width arrays. On the next run unchanged elements are skipped
+before they are shaped, and only insert/update/delete deltas are written. An OSM
+change file (.osc) can be applied the same way.
+"""
+
+import bisect
+import csv
+import heapq
+import os
+import xml.etree.cElementTree as ET
+from array import array
+from itertools import islice, izip
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+
+# Fixed-width signed 64 bit on the platforms we run on; checked when loading
+ARRAY_TYPE = 'l'
+
+CHANGES_FIELDS = ['type', 'id', 'action']
+
+OSC_ACTIONS = {'create': 'insert', 'modify': 'update', 'delete': 'delete'}
+
+
+class VersionIndex(object):
+    """Sorted id and version arrays per element type"""
+
+    def __init__(self):
+        self.ids = dict((t, array(ARRAY_TYPE)) for t in ELEMENT_TYPES)
+        self.versions = dict((t, array(ARRAY_TYPE)) for t in ELEMENT_TYPES)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            header = f.readline().split()
+            if header[0] != 'osm-version-index' or int(header[1]) != array(ARRAY_TYPE).itemsize:
+                raise ValueError('{0} is not a version index written on this platform'.format(path))
+            for element_type in ELEMENT_TYPES:
+                line = f.readline()
+                if not line:
+                    raise ValueError('{0} has no {1} section (saved by an older version); rebuild required: '
+                                     'delete it and run again for a full conversion'.format(path, element_type))
+                count = int(line)
+                index.ids[element_type].fromfile(f, count)
+                index.versions[element_type].fromfile(f, count)
+        return index
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write('osm-version-index {0}\n'.format(array(ARRAY_TYPE).itemsize))
+            for element_type in ELEMENT_TYPES:
+                f.write('{0}\n'.format(len(self.ids[element_type])))
+                self.ids[element_type].tofile(f)
+                self.versions[element_type].tofile(f)
+        os.rename(tmp_path, path)
+
+    def append(self, element_type, element_id, version):
+        self.ids[element_type].append(element_id)
+        self.versions[element_type].append(version)
+
+    def find(self, element_type, element_id):
+        """Position of element_id in the arrays, or -1"""
+
+        ids = self.ids[element_type]
+        i = bisect.bisect_left(ids, element_id)
+        if i < len(ids) and ids[i] == element_id:
+            return i
+        return -1
+
+    def sort(self):
+        """Planet extracts are already sorted by id; only re-sort if this one was not"""
+
+        for element_type in ELEMENT_TYPES:
+            ids = self.ids[element_type]
+            if any(a > b for a, b in izip(ids, islice(ids, 1, None))):
+                pairs = sorted(izip(ids, self.versions[element_type]))
+                self.ids[element_type] = array(ARRAY_TYPE, (i for i, _ in pairs))
+                self.versions[element_type] = array(ARRAY_TYPE, (v for _, v in pairs))
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.ids.itervalues())
+
+
+class ChangeTracker(object):
+    """Compare a full extract against the previous index, element by element"""
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.current = VersionIndex()
+        self.seen = dict((t, bytearray(len(previous.ids[t]))) for t in ELEMENT_TYPES)
+
+    def check(self, element_type, element_id, version):
+        """Return 'insert', 'update' or None if the element is unchanged"""
+
+        element_id, version = int(element_id), int(version)
+        self.current.append(element_type, element_id, version)
+
+        i = self.previous.find(element_type, element_id)
+        if i < 0:
+            return 'insert'
+        self.seen[element_type][i] = 1
+        if self.previous.versions[element_type][i] == version:
+            return None
+        return 'update'
+
+    def finish(self, change_sink):
+        """Record every previous element that is no longer in the extract as deleted"""
+
+        for element_type in ELEMENT_TYPES:
+            seen = self.seen[element_type]
+            for i, element_id in enumerate(self.previous.ids[element_type]):
+                if not seen[i]:
+                    change_sink.record(element_type, element_id, 'delete')
+
+        self.current.sort()
+        return self.current
+
+
+class OscChanges(object):
+    """Apply an osmChange file (create/modify/delete blocks) on top of the previous index"""
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.action = None
+        self.changes = dict((t, {}) for t in ELEMENT_TYPES)
+
+    def _iter_changes(self, osc_file):
+        """Yield (action, element) for every element of the create/modify/delete blocks"""
+
+        context = ET.iterparse(osc_file, events=('start', 'end'))
+        _, root = next(context)
+        block = None
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag in OSC_ACTIONS:
+                    action = OSC_ACTIONS[elem.tag]
+                    block = elem
+                continue
+
+            if elem.tag in ELEMENT_TYPES and block is not None:
+                yield action, elem
+                block.clear()
+            elif elem.tag in OSC_ACTIONS:
+                block = None
+                root.clear()
+
+    def elements(self, osc_file, change_sink):
+        """
+        Yield created and modified elements; deletes are recorded straight away.
+        A file that changes an element more than once only applies its last change,
+        found in a first pass over the file.
+        """
+
+        last = {}
+        for i, (_, elem) in enumerate(self._iter_changes(osc_file)):
+            last[elem.tag, elem.attrib['id']] = i
+
+        for i, (action, elem) in enumerate(self._iter_changes(osc_file)):
+            if last[elem.tag, elem.attrib['id']] != i:
+                continue
+            self.action = action
+            if self.action == 'delete':
+                element_id = int(elem.attrib['id'])
+                self.changes[elem.tag][element_id] = None
+                change_sink.record(elem.tag, element_id, 'delete')
+            else:
+                yield elem
+
+    def check(self, element_type, element_id, version):
+        element_id = int(element_id)
+        self.changes[element_type][element_id] = int(version)
+        if self.action == 'insert' and self.previous.find(element_type, element_id) >= 0:
+            return 'update'
+        return self.action
+
+    def finish(self, change_sink):
+        """Merge the changes into a new sorted index"""
+
+        index = VersionIndex()
+        for element_type in ELEMENT_TYPES:
+            changes = self.changes[element_type]
+            kept = ((i, v) for i, v in izip(self.previous.ids[element_type],
+                                            self.previous.versions[element_type])
+                    if i not in changes)
+            changed = sorted((i, v) for i, v in changes.iteritems() if v is not None)
+            for element_id, version in heapq.merge(kept, changed):
+                index.append(element_type, element_id, version)
+        return index
+
+
+class ChangeLog(object):
+    """changes.csv next to the delta csvs: which ids to delete before loading the deltas"""
+
+    def __init__(self, path):
+        self.changes_file = open(path, 'wb')
+        self.writer = csv.writer(self.changes_file)
+        self.writer.writerow(CHANGES_FIELDS)
+
+    def record(self, element_type, element_id, action):
+        self.writer.writerow([element_type, element_id, action])
+
+    def close(self):
+        self.changes_file.close()
+
+    def abort(self):
+        self.changes_file.close()
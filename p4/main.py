@@ -1,18 +1,31 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
+import cPickle
 import csv
 import codecs
+import multiprocessing
+import os
 import pprint
 import re
-import xml.etree.cElementTree as ET
-import cerberus
+import shutil
+import tempfile
 import schema
-
+import database
+import element_source
+import columnar
+import geometry
+import incremental
+import tag_rules
+import validation
+
+from array import array
 from collections import defaultdict
 import operator
 
 from audit import update_street, update_postal, update_county, update_phone
+from audit import CLEANER_STATS, merge_cleaner_stats, print_cleaner_stats
 
 OSM_PATH = "./input/sample.osm"
 
@@ -21,237 +34,772 @@ NODE_TAGS_PATH = "./output/nodes_tags.csv"
 WAYS_PATH = "./output/ways.csv"
 WAY_NODES_PATH = "./output/ways_nodes.csv"
 WAY_TAGS_PATH = "./output/ways_tags.csv"
+RELATIONS_PATH = "./output/relations.csv"
+RELATION_MEMBERS_PATH = "./output/relations_members.csv"
+RELATION_TAGS_PATH = "./output/relations_tags.csv"
+
+# Incremental runs write only changed rows here, plus changes.csv listing ids to delete
+DELTA_DIR = "./output/delta"
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 SCHEMA = schema.schema
 
+# Shaped elements validated together before they are written, and rows per writerows
+VALIDATION_BATCH = 1000
+WRITE_BATCH = 10000
+
 # Make sure the fields order in the csvs matches the column order in the sql table schema
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_type', 'member_id', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+# Way rows are the WAY_FIELDS attributes followed by the geometry computed from the
+# node locations (empty when geometry is off)
+WAY_ROW_FIELDS = WAY_FIELDS + geometry.GEOMETRY_FIELDS
+
+# Row tuples for each schema.py key are in the order of its field list
+ROW_FIELDS = {'node': NODE_FIELDS,
+              'node_tags': NODE_TAGS_FIELDS,
+              'way': WAY_ROW_FIELDS,
+              'way_nodes': WAY_NODES_FIELDS,
+              'way_tags': WAY_TAGS_FIELDS,
+              'relation': RELATION_FIELDS,
+              'relation_members': RELATION_MEMBERS_FIELDS,
+              'relation_tags': RELATION_TAGS_FIELDS}
+
+# Compiled once at startup; workers inherit them
+SCHEMA_CHECKS = validation.compile_schema(SCHEMA, ROW_FIELDS)
+
+# (output path, field list) in the order the csvs are opened in process_map
+CSV_OUTPUTS = [(NODES_PATH, NODE_FIELDS),
+               (NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+               (WAYS_PATH, WAY_ROW_FIELDS),
+               (WAY_NODES_PATH, WAY_NODES_FIELDS),
+               (WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+               (RELATIONS_PATH, RELATION_FIELDS),
+               (RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+               (RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
+
+# (sql table, schema.py key, field list) in the same order as CSV_OUTPUTS
+SQL_TABLES = [('nodes', 'node', NODE_FIELDS),
+              ('nodes_tags', 'node_tags', NODE_TAGS_FIELDS),
+              ('ways', 'way', WAY_ROW_FIELDS),
+              ('ways_nodes', 'way_nodes', WAY_NODES_FIELDS),
+              ('ways_tags', 'way_tags', WAY_TAGS_FIELDS),
+              ('relations', 'relation', RELATION_FIELDS),
+              ('relations_members', 'relation_members', RELATION_MEMBERS_FIELDS),
+              ('relations_tags', 'relation_tags', RELATION_TAGS_FIELDS)]
+
+# Node store the parallel workers read way geometry from; filled before the pool forks
+NODE_LOCATIONS = None
+
+# Top level elements shaped into rows
+SHAPED_TAGS = ('node', 'way', 'relation')
+
+# Top level elements a byte range is allowed to start on
+ELEMENT_STARTS = ('<node ', '<node>', '<way ', '<way>', '<relation ', '<relation>')
 
 # USING TO COUNT ISSUES
 COUNTER_DICT = defaultdict(int)
 STREET_ISSUE = defaultdict(int)
 
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
+# CLEANERS APPLIED TO TAG VALUES, KEYED ON THE TAG KEY ('*:' MATCHES ANY PREFIX)
+TAG_RULES = tag_rules.TagRules(PROBLEMCHARS, LOWER_COLON)
+TAG_RULES.register('*:state', lambda value: 'GA')
+TAG_RULES.register('*:street', lambda value: update_street(value, STREET_ISSUE))
+TAG_RULES.register('*:postcode', update_postal)
+TAG_RULES.register('*:county', update_county)
+TAG_RULES.register('phone', update_phone)
 
-    # CLEANING FIRST DESPITE NODE OR WAY !!!!!
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', tag_rules=TAG_RULES,
+                  node_locations=None, relation_attr_fields=RELATION_FIELDS):
+    """
+    Shape a node, way or relation into its rows in one pass over the children.
+    Rows are tuples in the order of the matching *_FIELDS list.
+    Tags are cleaned and typed by tag_rules; register new cleaners there.
+    With node_locations (geometry.py) way rows get their geometry columns filled in.
+    """
 
-    if element.tag == 'node' or element.tag == 'way':
+    tags = []  # Handle secondary tags the same way for every element type
 
-      for child in element:
-        
-        if child.tag == 'tag':
-          child_tag = {}
-          
-          #COUNTER_DICT[child.attrib['k']] +=1
-          
-          # CHECKING FOR PROBLEMATIC CHARACTERS
-          if not PROBLEMCHARS.search(child.attrib['k']):
-          
-            # WORKING WITH "TYPES"
-            if LOWER_COLON.search(child.attrib['k']):
-              
-              # CLEANING ATTRIBUTES WITH ":" SUCH AS ADDR:
-              sub_attr = child.attrib['k'].split(':', 1)[1]
-
-              # CLEANING STATES
-              if sub_attr == 'state':
-                child.attrib['v'] = 'GA'
-              
-              # CLEANING STREETS
-              elif sub_attr == 'street':
-                child.attrib['v'] = update_street(child.attrib['v'], STREET_ISSUE)
-              
-              # CLEANING POSTCODES
-              elif sub_attr == 'postcode':
-                child.attrib['v'] = update_postal(child.attrib['v'])
-
-              # CLEANING COUNTIES
-              elif sub_attr == 'county':
-                child.attrib['v'] = update_county(child.attrib['v'])
-
-            # CLEANING PHONE
-            elif child.attrib['k'] == 'phone':
-              child.attrib['v'] = update_phone(child.attrib['v'])
-
-
-    # ADDING ENTRIES TO NODES AND WAYS DICTIONARY
     if element.tag == 'node':
-
-      for item in element.attrib:
-        if item in NODE_FIELDS:
-          node_attribs[item] = element.attrib[item]
+      attrib = element.attrib
+      node_id = attrib['id']
 
       for child in element:
-        
         if child.tag == 'tag':
-          child_tag = {}
-          
-          # CHECKING FOR PROBLEMATIC CHARACTERS
-          if not PROBLEMCHARS.search(child.attrib['k']):
-          
-            # WORKING WITH "TYPES"
-            if LOWER_COLON.search(child.attrib['k']):
-              
-              s = child.attrib['k']
-              child_tag['type'] = s[0:s.find(':')]
-
-            else:
-              child_tag['type'] = 'regular'
-
-
-            # ADDING TAGS TO NODE_TAGS
-            child_tag['id'] = node_attribs['id']
-            child_tag['key'] = child.attrib['k']
-            child_tag['value'] = child.attrib['v']
-
+          child_tag = tag_rules.shape_tag(node_id, child)
+          if child_tag is not None:
             tags.append(child_tag)
 
-      return {'node': node_attribs, 'node_tags': tags}
+      return {'node': tuple([attrib.get(field) for field in node_attr_fields]), 'node_tags': tags}
 
 
     elif element.tag == 'way':
+      attrib = element.attrib
+      way_id = attrib['id']
+      way_nodes = []
       counter = 0
 
-      for item in element.attrib:
-        if item in WAY_FIELDS:
-          way_attribs[item] = element.attrib[item]
-
-
       for child in element:
-        nd_temp = {}
-        tag_temp = {}
 
         # WORKING WITH WAY_NODES
         if child.tag == 'nd':
+          way_nodes.append((way_id, child.attrib['ref'], counter))
+          counter += 1
 
-          nd_temp['id'] = way_attribs['id']
-          nd_temp['node_id'] = child.attrib['ref']
-          nd_temp['position'] = counter
-          
-          counter +=1
+        # WORKING WITH TAGS
+        elif child.tag == 'tag':
+          child_tag = tag_rules.shape_tag(way_id, child)
+          if child_tag is not None:
+            tags.append(child_tag)
 
-          way_nodes.append(nd_temp)
+      if node_locations is not None:
+        way_geometry = geometry.way_geometry(node_locations, [ref for _, ref, _ in way_nodes])
+      else:
+        way_geometry = geometry.NO_GEOMETRY
 
-        if child.tag == 'tag':
+      return {'way': tuple([attrib.get(field) for field in way_attr_fields]) + way_geometry,
+              'way_nodes': way_nodes, 'way_tags': tags}
 
-          child_tag = {}
-          
-          # CHECKING FOR PROBLEMATIC CHARACTERS
-          if not PROBLEMCHARS.search(child.attrib['k']):
-          
-          # WORKING WITH "TYPES"
-            if LOWER_COLON.search(child.attrib['k']):
-                s = child.attrib['k']
-                child_tag['type'] = s[0:s.find(':')]
-            else:
-              child_tag['type'] = 'regular'
-
-            # WORKING WITH TAGS
-            child_tag['id'] = way_attribs['id']
-            child_tag['key'] = child.attrib['k']
-            child_tag['value'] = child.attrib['v']
 
+    elif element.tag == 'relation':
+      attrib = element.attrib
+      relation_id = attrib['id']
+      members = []
+      counter = 0
+
+      for child in element:
+
+        # WORKING WITH MEMBERS (nodes, ways or other relations, in order)
+        if child.tag == 'member':
+          member = child.attrib
+          members.append((relation_id, member['type'], member['ref'], member.get('role', ''), counter))
+          counter += 1
+
+        # WORKING WITH TAGS
+        elif child.tag == 'tag':
+          child_tag = tag_rules.shape_tag(relation_id, child)
+          if child_tag is not None:
             tags.append(child_tag)
 
-      return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+      return {'relation': tuple([attrib.get(field) for field in relation_attr_fields]),
+              'relation_members': members, 'relation_tags': tags}
 
 
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend=element_source.DEFAULT_BACKEND):
+    """Yield element if it is the right type of tag (see element_source.py for the backends)"""
+
+    return element_source.iter_elements(osm_file, tags, backend)
+
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+def validate_elements(elements, checks=SCHEMA_CHECKS, schema=SCHEMA):
+    """Raise Exception (same message as cerberus validation) if any element does not match schema"""
+    validation.validate_batch(elements, checks, schema, ROW_FIELDS)
 
 
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-        
-        raise Exception(message_string.format(field, error_string))
+class UnicodeWriter(object):
+    """
+    csv writer for row tuples in fields order. Encodes unicode values as UTF-8 and
+    writes rows in batches with writerows; call flush() before closing the file.
+    """
 
+    def __init__(self, f, fields, batch_size=WRITE_BATCH):
+        self.writer = csv.writer(f)
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = []
 
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+    def writeheader(self):
+        self.writer.writerow(self.fields)
 
     def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
-        })
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows([[v.encode('utf-8') if isinstance(v, unicode) else v for v in row]
+                               for row in self.rows])
+        self.rows = []
+
+
+class RowBatchWriter(object):
+    """
+    Part file writer for the parallel SQLite and columnar sinks: row tuples are pickled
+    a batch at a time, so None values and types reach the loader as shape_element made them.
+    """
+
+    def __init__(self, f, fields, batch_size=WRITE_BATCH):
+        self.f = f
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = []
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            cPickle.dump(self.rows, self.f, cPickle.HIGHEST_PROTOCOL)
+            self.rows = []
+
+
+def read_row_batches(path):
+    """Rows of a RowBatchWriter part file, in order"""
+
+    with open(path, 'rb') as part_file:
+        while True:
+            try:
+                rows = cPickle.load(part_file)
+            except EOFError:
+                return
+            for row in rows:
+                yield row
+
+
+def write_rows(shaped, writers):
+    """Write shaped elements through the eight writers (CSV_OUTPUTS order)"""
+
+    (nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer,
+     relations_writer, relation_members_writer, relation_tags_writer) = writers
+
+    for el in shaped:
+        if 'node' in el:
+            nodes_writer.writerow(el['node'])
+            node_tags_writer.writerows(el['node_tags'])
+        elif 'way' in el:
+            ways_writer.writerow(el['way'])
+            way_nodes_writer.writerows(el['way_nodes'])
+            way_tags_writer.writerows(el['way_tags'])
+        else:
+            relations_writer.writerow(el['relation'])
+            relation_members_writer.writerows(el['relation_members'])
+            relation_tags_writer.writerows(el['relation_tags'])
+
+
+def write_elements(elements, writers, validate, tracker=None, change_sink=None,
+                   node_locations=None, record_nodes=True):
+    """
+    Shape each element and write its rows through the writers (CSV_OUTPUTS order).
+    With a tracker (incremental.py) unchanged elements are skipped before shaping and
+    every insert/update is recorded on change_sink.
+    With node_locations every node is recorded there (unless record_nodes is False,
+    when it was filled beforehand) and way rows get their geometry.
+    A batch is also written out once it holds WRITE_BATCH relation members, so a run of
+    large route relations is not buffered whole.
+    """
+
+    batch = []
+
+    def flush():
+        if validate is True:
+            validate_elements(batch)
+        write_rows(batch, writers)
+        del batch[:]
+
+    record = node_locations is not None and record_nodes
+    members = 0
+    for element in elements:
+        if record and element.tag == 'node':
+            attrib = element.attrib
+            node_locations.add(attrib['id'], attrib['lat'], attrib['lon'])
+
+        if tracker is not None:
+            element_id = element.attrib['id']
+            action = tracker.check(element.tag, element_id, element.attrib['version'])
+            if action is None:
+                continue
+            change_sink.record(element.tag, element_id, action)
+
+        el = shape_element(element, node_locations=node_locations)
+
+        if el:
+            batch.append(el)
+            if 'relation' in el:
+                members += len(el['relation_members'])
+            if len(batch) >= VALIDATION_BATCH or members >= WRITE_BATCH:
+                flush()
+                members = 0
+    flush()
+
+    for writer in writers:
+        writer.flush()
+
+
+def report():
+    """Print the issue counters and what the cleaning stage cost"""
+
+    # CHECKING STRUCTURE, ISSUES, ETC.
+    ##pprint.pprint(STREET_ISSUE)
+    pprint.pprint(sorted(COUNTER_DICT.items(), key=operator.itemgetter(1), reverse = True))
+    print_cleaner_stats()
+
+
+# ================================================== #
+#               Parallel Helpers                     #
+# ================================================== #
+def _next_element_offset(osm_file, offset):
+    """Return the byte offset of the first top level element starting at or after offset"""
+
+    osm_file.seek(offset)
+    if offset > 0:
+        # Finish the partial line we landed in
+        osm_file.readline()
+
+    while True:
+        position = osm_file.tell()
+        line = osm_file.readline()
+        if not line:
+            return None
+        stripped = line.lstrip()
+        if stripped.startswith(ELEMENT_STARTS):
+            return position + len(line) - len(stripped)
+        if stripped.startswith('</osm>'):
+            return None
+
+
+def split_osm(file_in, chunks):
+    """
+    Split an OSM file into (start, end) byte ranges that each begin on a top level element.
+    Assumes one element start per line, which is how the metro extracts are written.
+    """
+
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(0, os.SEEK_END)
+        size = osm_file.tell()
+
+        first = _next_element_offset(osm_file, 0)
+        if first is None:
+            return []
+
+        # Everything after the last element is the closing </osm> tag
+        osm_file.seek(max(size - 1024, 0))
+        tail = osm_file.read()
+        close = tail.rfind('</osm>')
+        if close < 0:
+            raise ValueError('{0} does not end with a closing </osm> tag; is it truncated?'.format(file_in))
+        end = size - len(tail) + close
+
+        starts = [first]
+        for i in range(1, chunks):
+            offset = _next_element_offset(osm_file, max(first, size * i // chunks))
+            if offset is not None and starts[-1] < offset < end:
+                starts.append(offset)
+
+    return zip(starts, starts[1:] + [end])
+
+
+class OSMRangeReader(object):
+    """File-like object over a byte range of an OSM file, wrapped in its own <osm> root"""
+
+    def __init__(self, file_in, start, end):
+        self.osm_file = open(file_in, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.head = '<osm>\n'
+        self.tail = '</osm>\n'
+
+    def read(self, size=65536):
+        if self.head:
+            data, self.head = self.head, ''
+            return data
+        if self.remaining > 0:
+            data = self.osm_file.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if data:
+                return data
+            self.remaining = 0
+        data, self.tail = self.tail, ''
+        return data
+
+    def close(self):
+        self.osm_file.close()
+
+
+def _process_range(args):
+    """
+    Worker: shape, clean and validate one byte range into headerless part csvs, or into
+    pickled row batches (typed=True) for the SQLite and columnar sinks
+    """
+
+    file_in, start, end, validate, part_dir, index, backend, typed = args
+
+    part_paths = [os.path.join(part_dir, '{0}.{1}'.format(os.path.basename(path), index))
+                  for path, _ in CSV_OUTPUTS]
+    part_files = [open(path, 'wb') for path in part_paths]
+    part_writer = RowBatchWriter if typed else UnicodeWriter
+    writers = [part_writer(f, fields) for f, (_, fields) in zip(part_files, CSV_OUTPUTS)]
+
+    STREET_ISSUE.clear()
+    CLEANER_STATS.clear()
+
+    reader = OSMRangeReader(file_in, start, end)
+    try:
+        write_elements(get_element(reader, tags=SHAPED_TAGS, backend=backend), writers, validate,
+                       node_locations=NODE_LOCATIONS, record_nodes=False)
+    finally:
+        reader.close()
+        for f in part_files:
+            f.close()
+
+    return part_paths, dict(STREET_ISSUE), dict(CLEANER_STATS)
+
+
+def _node_range(args):
+    """
+    Worker: the node ids and fixed point locations of one byte range, saved as three
+    arrays for the parent to add to its node store
+    """
+
+    file_in, start, end, part_dir, index, backend = args
+
+    ids = array(geometry.ID_ARRAY_TYPE)
+    lats = array(geometry.COORD_ARRAY_TYPE)
+    lons = array(geometry.COORD_ARRAY_TYPE)
+    reader = OSMRangeReader(file_in, start, end)
+    try:
+        for element in get_element(reader, tags=('node',), backend=backend):
+            attrib = element.attrib
+            ids.append(int(attrib['id']))
+            lats.append(geometry.to_fixed(attrib['lat']))
+            lons.append(geometry.to_fixed(attrib['lon']))
+    finally:
+        reader.close()
+
+    path = os.path.join(part_dir, 'nodes.{0}'.format(index))
+    with open(path, 'wb') as f:
+        for values in (ids, lats, lons):
+            values.tofile(f)
+    return path, len(ids)
+
+
+def read_node_range(path, count):
+    """The (ids, lats, lons) arrays _node_range saved"""
+
+    arrays = []
+    with open(path, 'rb') as f:
+        for typecode in (geometry.ID_ARRAY_TYPE, geometry.COORD_ARRAY_TYPE, geometry.COORD_ARRAY_TYPE):
+            values = array(typecode)
+            values.fromfile(f, count)
+            arrays.append(values)
+    return arrays
+
+
+def process_map_parallel(file_in, validate, workers, db_path=None, backend=element_source.DEFAULT_BACKEND,
+                         node_locations=None, columnar_dir=None):
+    """
+    Split the OSM file into element aligned byte ranges, process them in a pool of
+    worker processes and concatenate the per-range csvs in file order.
+    Output is identical to process_map run on a single core.
+    With db_path (or columnar_dir) the per-range rows are loaded into SQLite (or the
+    columnar format) instead of merged csvs.
+    With node_locations a first parallel pass collects the nodes of every range, since
+    a range of ways needs nodes from other ranges. The parent adds them to the store
+    in file order (a few array copies for id sorted input) and the workers of the main
+    pass inherit it read only. The first pass reads the file once more, but split over
+    the workers rather than in the parent.
+    """
+    global NODE_LOCATIONS
+
+    # A few ranges per worker keeps the pool busy when ranges differ in density
+    ranges = split_osm(file_in, workers * 4)
+    part_dir = tempfile.mkdtemp(dir=os.path.dirname(NODES_PATH) or '.')
+
+    try:
+        if node_locations is not None:
+            pool = multiprocessing.Pool(workers)
+            try:
+                node_parts = pool.map(_node_range,
+                                      [(file_in, start, end, part_dir, i, backend)
+                                       for i, (start, end) in enumerate(ranges)],
+                                      chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            for path, count in node_parts:
+                node_locations.extend(*read_node_range(path, count))
+                os.remove(path)
+
+        # Forked after the node store is filled, so every worker sees all of it
+        NODE_LOCATIONS = node_locations
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_process_range,
+                               [(file_in, start, end, validate, part_dir, i, backend,
+                                 bool(db_path or columnar_dir))
+                                for i, (start, end) in enumerate(ranges)],
+                               chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            NODE_LOCATIONS = None
+
+        loader = open_loader(db_path, columnar_dir)
+        if loader is not None:
+            try:
+                for i, writer in enumerate(loader.writers):
+                    for part_paths, _, _ in results:
+                        for row in read_row_batches(part_paths[i]):
+                            writer.writerow(row)
+                loader.close()
+            finally:
+                loader.abort()
+        else:
+            for i, (path, fields) in enumerate(CSV_OUTPUTS):
+                with open(path, 'wb') as out_file:
+                    UnicodeWriter(out_file, fields).writeheader()
+                    for part_paths, _, _ in results:
+                        with open(part_paths[i], 'rb') as part_file:
+                            shutil.copyfileobj(part_file, out_file)
+
+        for _, street_issue, cleaner_stats in results:
+            for street_type, count in street_issue.iteritems():
+                STREET_ISSUE[street_type] += count
+            merge_cleaner_stats(cleaner_stats)
+    finally:
+        shutil.rmtree(part_dir)
+
+    report()
 
 
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-         codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-         codecs.open(WAYS_PATH, 'w') as ways_file, \
-         codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-         codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-
-        # CHECKING STRUCTURE, ISSUES, ETC.
-        ##pprint.pprint(STREET_ISSUE)
-        pprint.pprint(sorted(COUNTER_DICT.items(), key=operator.itemgetter(1), reverse = True))
+def open_csv_writers(directory=None):
+    """Open the csvs of CSV_OUTPUTS (in directory instead of their usual paths if given) with headers"""
+
+    files, writers = [], []
+    for path, fields in CSV_OUTPUTS:
+        if directory is not None:
+            path = os.path.join(directory, os.path.basename(path))
+        f = codecs.open(path, 'w')
+        writer = UnicodeWriter(f, fields)
+        writer.writeheader()
+        files.append(f)
+        writers.append(writer)
+    return files, writers
+
+
+def open_node_locations(with_geometry=True, flat_nodes=None):
+    """Node store for way geometry: None when it is off, the memory-mapped file at flat_nodes if given"""
+
+    if not with_geometry:
+        return None
+    if flat_nodes:
+        return geometry.FlatNodeLocations(flat_nodes)
+    return geometry.NodeLocations()
+
+
+def open_loader(db_path=None, columnar_dir=None):
+    """Sink that replaces the csvs: a SQLite BulkLoader, a columnar.StoreWriter, or None for csvs"""
+
+    if db_path:
+        return database.BulkLoader(db_path, SQL_TABLES, SCHEMA)
+    if columnar_dir:
+        return columnar.StoreWriter(columnar_dir, SQL_TABLES, SCHEMA)
+    return None
+
+
+def process_map(file_in, validate, workers=1, db_path=None, backend=element_source.DEFAULT_BACKEND,
+                with_geometry=True, flat_nodes=None, columnar_dir=None):
+    """
+    Iteratively process each XML element and write to csv(s).
+    With db_path the rows are bulk loaded into that SQLite database instead, with
+    columnar_dir they are written there as dictionary encoded columns (columnar.py).
+    Way rows get centroid, bounding box and length unless with_geometry is False;
+    node locations are kept in RAM, or in the flat_nodes file for very large extracts.
+    """
+
+    node_locations = open_node_locations(with_geometry, flat_nodes)
+    try:
+        if workers > 1:
+            return process_map_parallel(file_in, validate, workers, db_path, backend, node_locations,
+                                        columnar_dir)
+        _process_map(file_in, validate, db_path, backend, node_locations, columnar_dir)
+    finally:
+        if node_locations is not None:
+            node_locations.close()
+
+
+def _process_map(file_in, validate, db_path, backend, node_locations, columnar_dir=None):
+    loader = open_loader(db_path, columnar_dir)
+    if loader is not None:
+        try:
+            write_elements(get_element(file_in, tags=SHAPED_TAGS, backend=backend), loader.writers, validate,
+                           node_locations=node_locations)
+            loader.close()
+        finally:
+            loader.abort()
+
+        report()
+        return
+
+    files, writers = open_csv_writers()
+    try:
+        write_elements(get_element(file_in, tags=SHAPED_TAGS, backend=backend), writers, validate,
+                       node_locations=node_locations)
+    finally:
+        for f in files:
+            f.close()
+
+    report()
+
+
+def process_changes(file_in, validate, index_path, db_path=None, osc=False,
+                    backend=element_source.DEFAULT_BACKEND, with_geometry=True, flat_nodes=None):
+    """
+    Incremental run against the (id, version) index saved by the previous run.
+
+    file_in is either a full extract (unchanged elements are skipped, vanished ones are
+    deleted) or, with osc=True, an osmChange file. With db_path the deltas are applied to
+    the existing database; otherwise the changed rows are written to DELTA_DIR with a
+    changes.csv of ids to delete before loading them. Without a previous index this is a
+    full process_map run that saves the index for next time.
+
+    With db_path the geometry of changed ways, and of unchanged ways whose nodes moved,
+    is recomputed from the nodes table. The delta csvs only carry the changed ways, and
+    from an osmChange file (which has only the changed nodes) their geometry needs the
+    flat_nodes file kept from the earlier runs; without it the columns stay empty.
+    """
+
+    node_locations = open_node_locations(with_geometry and (flat_nodes or not osc), flat_nodes)
+    try:
+        _process_changes(file_in, validate, index_path, db_path, osc, backend, with_geometry,
+                         node_locations)
+    finally:
+        if node_locations is not None:
+            node_locations.close()
+
+
+def _process_changes(file_in, validate, index_path, db_path, osc, backend, with_geometry, node_locations):
+    if not os.path.exists(index_path):
+        if osc:
+            raise IOError('No version index at {0} to apply {1} to'.format(index_path, file_in))
+        tracker = incremental.ChangeTracker(incremental.VersionIndex())
+        elements = (element for element in get_element(file_in, tags=SHAPED_TAGS, backend=backend)
+                    if tracker.check(element.tag, element.attrib['id'], element.attrib['version']))
+        if db_path:
+            loader = database.BulkLoader(db_path, SQL_TABLES, SCHEMA)
+            try:
+                write_elements(elements, loader.writers, validate, node_locations=node_locations)
+                loader.close()
+            finally:
+                loader.abort()
+        else:
+            files, writers = open_csv_writers()
+            try:
+                write_elements(elements, writers, validate, node_locations=node_locations)
+            finally:
+                for f in files:
+                    f.close()
+        tracker.finish(None).save(index_path)
+        report()
+        return
+
+    previous = incremental.VersionIndex.load(index_path)
+
+    files = []
+    if db_path:
+        change_sink = database.BulkLoader(db_path, SQL_TABLES, SCHEMA, append=True)
+        writers = change_sink.writers
+    else:
+        if not os.path.isdir(DELTA_DIR):
+            os.makedirs(DELTA_DIR)
+        change_sink = incremental.ChangeLog(os.path.join(DELTA_DIR, 'changes.csv'))
+
+    try:
+        if not db_path:
+            files, writers = open_csv_writers(DELTA_DIR)
+
+        if osc:
+            tracker = incremental.OscChanges(previous)
+            elements = tracker.elements(file_in, change_sink)
+        else:
+            tracker = incremental.ChangeTracker(previous)
+            elements = get_element(file_in, tags=SHAPED_TAGS, backend=backend)
+
+        write_elements(elements, writers, validate, tracker, change_sink, node_locations)
+        index = tracker.finish(change_sink)
+        if db_path and with_geometry:
+            change_sink.update_way_geometry()
+        change_sink.close()
+    finally:
+        change_sink.abort()
+        for f in files:
+            f.close()
+    index.save(index_path)
+
+    report()
+
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(OSM_PATH, validate=False)
+    parser = argparse.ArgumentParser(description='Convert an OSM file to csvs')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--validate', action='store_true',
+                        help='validate every element against schema.py')
+    sinks = parser.add_mutually_exclusive_group()
+    sinks.add_argument('--sqlite', metavar='DB_PATH', dest='db_path',
+                       help='load straight into this SQLite database instead of csvs')
+    sinks.add_argument('--columnar', metavar='DIR', dest='columnar_dir',
+                       help='write dictionary encoded numpy columns to DIR instead of csvs')
+    parser.add_argument('--incremental', metavar='INDEX_PATH', dest='index_path',
+                        help='only write what changed since the run that saved this index')
+    parser.add_argument('--osc', action='store_true',
+                        help='osm_file is an osmChange file to apply (needs --incremental)')
+    parser.add_argument('--no-geometry', action='store_false', dest='with_geometry',
+                        help='leave the way centroid, bounding box and length columns empty')
+    parser.add_argument('--flat-nodes', metavar='PATH',
+                        help='keep node locations in this memory-mapped file instead of RAM '
+                             '(for full-state extracts; reused by --incremental runs)')
+    parser.add_argument('--parser', choices=element_source.available_backends(),
+                        default=element_source.DEFAULT_BACKEND,
+                        help='XML backend (default: {0})'.format(element_source.DEFAULT_BACKEND))
+    args = parser.parse_args()
+
+    if (args.index_path or args.osc) and args.workers > 1:
+        parser.error('--incremental runs on a single process')
+    if args.osc and not args.index_path:
+        parser.error('--osc needs the --incremental index of the previous run')
+    if args.columnar_dir and args.index_path:
+        parser.error('--columnar writes a full conversion; it cannot take --incremental deltas')
+
+    # Note: Validation runs compiled schema checks (validation.py) over batches
+    # of shaped elements, so it is cheap enough to leave on for full extracts.
+    if args.index_path:
+        process_changes(args.osm_file, validate=args.validate, index_path=args.index_path,
+                        db_path=args.db_path, osc=args.osc, backend=args.parser,
+                        with_geometry=args.with_geometry, flat_nodes=args.flat_nodes)
+    else:
+        process_map(args.osm_file, validate=args.validate, workers=args.workers,
+                    db_path=args.db_path, backend=args.parser,
+                    with_geometry=args.with_geometry, flat_nodes=args.flat_nodes,
+                    columnar_dir=args.columnar_dir)
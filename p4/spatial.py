@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index over the converted nodes and ways, and bbox/radius/nearest queries on it.
+
+The index is a SQLite R-tree per element type, next to the tables it covers:
+
+    nodes_rtree     one point box per node (lat, lon)
+    ways_rtree      the way's bounding box, for ways with geometry (geometry.py)
+
+BulkLoader builds it at the end of a --sqlite load and triggers keep it in step with
+incremental runs. For a database loaded some other way (the notebook's p3.db from the
+csvs) run `python spatial.py build p3.db` once.
+
+    index = SpatialIndex('atlanta.db')
+    index.within(33.7490, -84.3880, 1000, tag='amenity=restaurant')
+    index.nearest(33.7490, -84.3880, k=5, tag='amenity=cafe')
+    index.bbox(33.74, -84.40, 33.76, -84.37, tag='shop', element='way')
+
+R-tree boxes are stored as 32 bit floats, so candidates are filtered again on the exact
+coordinates. Without the R-tree module (or the index tables) the same queries still
+work, as full scans.
+"""
+
+import argparse
+import math
+import sqlite3
+import time
+from collections import namedtuple
+
+import geometry
+
+# element type: (table, rtree, tags table, min_lat, max_lat, min_lon, max_lon, lat, lon)
+ELEMENTS = {'node': ('nodes', 'nodes_rtree', 'nodes_tags', 'lat', 'lat', 'lon', 'lon', 'lat', 'lon'),
+            'way': ('ways', 'ways_rtree', 'ways_tags', 'min_lat', 'max_lat', 'min_lon', 'max_lon',
+                    'centroid_lat', 'centroid_lon')}
+
+# Metres in a degree of latitude
+METRES_PER_DEGREE = math.pi * geometry.EARTH_RADIUS_M / 180
+
+# nearest() starts with this radius and grows it 4x until it has k matches
+NEAREST_START_M = 250
+NEAREST_MAX_M = math.pi * geometry.EARTH_RADIUS_M
+
+# id, lat, lon (centroid for ways) and distance in metres (None for bbox queries)
+Hit = namedtuple('Hit', ['id', 'lat', 'lon', 'distance_m'])
+
+
+def rtree_available(conn):
+    try:
+        conn.execute('CREATE VIRTUAL TABLE temp.rtree_check USING rtree(id, a, b)')
+    except sqlite3.OperationalError:
+        return False
+    conn.execute('DROP TABLE temp.rtree_check')
+    return True
+
+
+def table_columns(conn, table):
+    return set(row[1] for row in conn.execute('PRAGMA table_info({0})'.format(table)))
+
+
+def create_index(conn):
+    """
+    (Re)build the R-trees from the nodes and ways tables and add the triggers that keep
+    them current. Returns False if this SQLite has no R-tree module.
+    """
+
+    if not rtree_available(conn):
+        return False
+
+    for element_type in sorted(ELEMENTS):
+        table, rtree, _, min_lat, max_lat, min_lon, max_lon, _, _ = ELEMENTS[element_type]
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(rtree))
+        conn.execute('DROP TRIGGER IF EXISTS {0}_insert'.format(rtree))
+        conn.execute('DROP TRIGGER IF EXISTS {0}_delete'.format(rtree))
+        conn.execute('DROP TRIGGER IF EXISTS {0}_update'.format(rtree))
+        if not set([min_lat, max_lat, min_lon, max_lon]) <= table_columns(conn, table):
+            continue
+
+        bounds = ', '.join([min_lat, max_lat, min_lon, max_lon])
+        new_bounds = ', '.join('NEW.' + column for column in [min_lat, max_lat, min_lon, max_lon])
+        conn.execute('CREATE VIRTUAL TABLE {0} USING rtree(id, min_lat, max_lat, min_lon, max_lon)'.format(rtree))
+        conn.execute('INSERT INTO {0} SELECT id, {1} FROM {2} WHERE {3} IS NOT NULL'.format(
+            rtree, bounds, table, min_lat))
+
+        conn.execute('CREATE TRIGGER {0}_insert AFTER INSERT ON {1} WHEN NEW.{2} IS NOT NULL BEGIN '
+                     'INSERT OR REPLACE INTO {0} VALUES (NEW.id, {3}); END'.format(
+                         rtree, table, min_lat, new_bounds))
+        conn.execute('CREATE TRIGGER {0}_delete AFTER DELETE ON {1} BEGIN '
+                     'DELETE FROM {0} WHERE id = OLD.id; END'.format(rtree, table))
+        conn.execute('CREATE TRIGGER {0}_update AFTER UPDATE ON {1} BEGIN '
+                     'DELETE FROM {0} WHERE id = OLD.id; '
+                     'INSERT INTO {0} SELECT NEW.id, {3} WHERE NEW.{2} IS NOT NULL; END'.format(
+                         rtree, table, min_lat, new_bounds))
+    return True
+
+
+def parse_tag(tag):
+    """'amenity=restaurant' or ('amenity', 'restaurant') -> (key, value); 'amenity' -> (key, None)"""
+
+    if tag is None or isinstance(tag, tuple):
+        return tag
+    key, _, value = tag.partition('=')
+    return key, (value if _ else None)
+
+
+def radius_bbox(lat, lon, radius_m):
+    """(min_lat, min_lon, max_lat, max_lon) around a circle; the full width of lon near the poles"""
+
+    dlat = radius_m / METRES_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlon = radius_m / (METRES_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 180.0
+    return (max(lat - dlat, -90.0), max(lon - dlon, -180.0),
+            min(lat + dlat, 90.0), min(lon + dlon, 180.0))
+
+
+class SpatialIndex(object):
+    """Queries over a database with the nodes/ways tables, using the R-trees when present"""
+
+    def __init__(self, db):
+        self.conn = sqlite3.connect(db) if isinstance(db, basestring) else db
+        tables = set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        self.indexed = dict((element_type, ELEMENTS[element_type][1] in tables) for element_type in ELEMENTS)
+        self.sql = {}
+
+    def _query_sql(self, element_type, tag):
+        """SELECT of (id, lat, lon) for elements overlapping a box, with an optional tag filter"""
+
+        cache_key = (element_type, tag is not None, tag is not None and tag[1] is not None)
+        if cache_key in self.sql:
+            return self.sql[cache_key]
+
+        table, rtree, tags_table, min_lat, max_lat, min_lon, max_lon, lat, lon = ELEMENTS[element_type]
+        where = ['e.{0} <= :max_lat AND e.{1} >= :min_lat AND e.{2} <= :max_lon AND e.{3} >= :min_lon'.format(
+            min_lat, max_lat, min_lon, max_lon)]
+        if self.indexed[element_type]:
+            source = '{0} r JOIN {1} e ON e.id = r.id'.format(rtree, table)
+            where.insert(0, 'r.min_lat <= :max_lat AND r.max_lat >= :min_lat AND '
+                            'r.min_lon <= :max_lon AND r.max_lon >= :min_lon')
+        else:
+            source = '{0} e'.format(table)
+        if tag is not None:
+            where.append('EXISTS (SELECT 1 FROM {0} t WHERE t.id = e.id AND t.key = :key{1})'.format(
+                tags_table, ' AND t.value = :value' if tag[1] is not None else ''))
+
+        sql = 'SELECT e.id, e.{0}, e.{1} FROM {2} WHERE {3}'.format(lat, lon, source, ' AND '.join(where))
+        self.sql[cache_key] = sql
+        return sql
+
+    def _rows(self, element_type, box, tag):
+        tag = parse_tag(tag)
+        params = dict(zip(['min_lat', 'min_lon', 'max_lat', 'max_lon'], box))
+        if tag is not None:
+            params['key'], params['value'] = tag
+        return self.conn.execute(self._query_sql(element_type, tag), params)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, tag=None, element='node'):
+        """Elements in (ways: overlapping) the box"""
+
+        return [Hit(element_id, lat, lon, None)
+                for element_id, lat, lon in self._rows(element, (min_lat, min_lon, max_lat, max_lon), tag)]
+
+    def within(self, lat, lon, radius_m, tag=None, element='node'):
+        """Elements (ways by centroid) within radius_m metres, nearest first"""
+
+        hits = []
+        for element_id, hit_lat, hit_lon in self._rows(element, radius_bbox(lat, lon, radius_m), tag):
+            if hit_lat is None:
+                continue
+            distance = geometry.distance_m(lat, lon, hit_lat, hit_lon)
+            if distance <= radius_m:
+                hits.append(Hit(element_id, hit_lat, hit_lon, distance))
+        hits.sort(key=lambda hit: hit.distance_m)
+        return hits
+
+    def nearest(self, lat, lon, k=1, tag=None, element='node', max_radius_m=NEAREST_MAX_M):
+        """
+        The k nearest elements. The search radius grows until it holds k matches: those
+        are then the k nearest, since anything outside the circle is farther away.
+        """
+
+        radius = NEAREST_START_M
+        while True:
+            hits = self.within(lat, lon, radius, tag, element)
+            if len(hits) >= k or radius >= max_radius_m:
+                return hits[:k]
+            radius = min(radius * 4, max_radius_m)
+
+
+def print_hits(hits, seconds):
+    for hit in hits:
+        distance = '' if hit.distance_m is None else '{0:.1f} m'.format(hit.distance_m)
+        print '{0}\t{1}\t{2}\t{3}'.format(hit.id, hit.lat, hit.lon, distance)
+    print '{0} results in {1:.2f} ms'.format(len(hits), seconds * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the spatial index of a converted database')
+    commands = parser.add_subparsers(dest='command')
+
+    build = commands.add_parser('build', help='(re)build the R-trees of an existing database')
+    build.add_argument('db_path')
+
+    for name, help_text in [('bbox', 'elements in a bounding box'),
+                            ('within', 'elements within a radius, nearest first'),
+                            ('nearest', 'the k nearest elements')]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('db_path')
+        if name == 'bbox':
+            command.add_argument('box', nargs=4, type=float, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+        else:
+            command.add_argument('lat', type=float)
+            command.add_argument('lon', type=float)
+        if name == 'within':
+            command.add_argument('radius_m', type=float)
+        if name == 'nearest':
+            command.add_argument('-k', type=int, default=5)
+        command.add_argument('--tag', help='key or key=value the element must have')
+        command.add_argument('--element', choices=sorted(ELEMENTS), default='node')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        conn = sqlite3.connect(args.db_path)
+        start = time.time()
+        if not create_index(conn):
+            parser.error('this SQLite build has no R-tree module')
+        conn.commit()
+        print 'Spatial index built in {0:.2f} s'.format(time.time() - start)
+    else:
+        index = SpatialIndex(args.db_path)
+        start = time.time()
+        if args.command == 'bbox':
+            hits = index.bbox(*args.box, tag=args.tag, element=args.element)
+        elif args.command == 'within':
+            hits = index.within(args.lat, args.lon, args.radius_m, tag=args.tag, element=args.element)
+        else:
+            hits = index.nearest(args.lat, args.lon, args.k, tag=args.tag, element=args.element)
+        print_hits(hits, time.time() - start)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Rule dispatch for <tag> children in shape_element.
+
+Every distinct tag key is classified once: whether it has problem characters,
+its type (the prefix before ':' or the default type) and which cleaner, if any,
+applies to its value. Extracts only have a few thousand distinct keys, so the
+regex work is done once per key instead of once per tag.
+"""
+
+
+class TagRules(object):
+    """Classify tag keys and hold the registered value cleaners"""
+
+    def __init__(self, problem_chars, lower_colon, default_tag_type='regular'):
+        self.problem_chars = problem_chars
+        self.lower_colon = lower_colon
+        self.default_tag_type = default_tag_type
+        self.key_cleaners = {}
+        self.sub_key_cleaners = {}
+        self.rules = {}
+
+    def register(self, key, cleaner):
+        """
+        Register cleaner(value) -> value for a tag key.
+        key is either an exact key ('phone', 'addr:city') or '*:<sub key>' to match
+        the part after the colon for any prefix ('*:street' matches addr:street and
+        tiger:street). Exact keys win over '*:' rules.
+        """
+
+        if key.startswith('*:'):
+            self.sub_key_cleaners[key[2:]] = cleaner
+        else:
+            self.key_cleaners[key] = cleaner
+        self.rules.clear()
+
+    def cleaner(self, key):
+        """Decorator form of register"""
+
+        def decorator(func):
+            self.register(key, func)
+            return func
+        return decorator
+
+    def classify(self, key):
+        """Return (type, cleaner or None) for a key, or None if the tag should be dropped"""
+
+        try:
+            return self.rules[key]
+        except KeyError:
+            pass
+
+        if self.problem_chars.search(key):
+            rule = None
+        else:
+            cleaner = self.key_cleaners.get(key)
+            if self.lower_colon.search(key):
+                tag_type, sub_key = key.split(':', 1)
+                if cleaner is None:
+                    cleaner = self.sub_key_cleaners.get(sub_key)
+            else:
+                tag_type = self.default_tag_type
+            rule = (tag_type, cleaner)
+
+        self.rules[key] = rule
+        return rule
+
+    def shape_tag(self, element_id, tag):
+        """Return the cleaned (id, key, value, type) row for a <tag> child, or None if it is dropped"""
+
+        key = tag.attrib['k']
+        rule = self.classify(key)
+        if rule is None:
+            return None
+
+        tag_type, cleaner = rule
+        value = tag.attrib['v']
+        if cleaner is not None:
+            value = cleaner(value)
+        return (element_id, key, value, tag_type)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Round trip of the columnar format, including rows with missing values"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import columnar
+import schema
+
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, nodes, tags):
+        writer = columnar.StoreWriter(self.directory, [('nodes', 'node', NODE_FIELDS),
+                                                       ('nodes_tags', 'node_tags', NODE_TAGS_FIELDS)],
+                                      schema.schema)
+        nodes_writer, tags_writer = writer.writers
+        nodes_writer.writerows(nodes)
+        tags_writer.writerows(tags)
+        writer.close()
+        return columnar.Store(self.directory)
+
+    def test_missing_uid_and_changeset(self):
+        store = self.write([('1', '33.7', '-84.3', 'a', '7', '1', '12', '2016-01-01T00:00:00Z'),
+                            ('2', '33.8', '-84.4', None, None, '1', '', '2016-01-02T10:20:30Z')],
+                           [('1', 'amenity', 'cafe', 'regular')])
+        nodes = store['nodes']
+        self.assertEqual(list(nodes['uid']), [7, columnar.NULL_INT])
+        self.assertEqual(list(nodes['changeset']), [12, columnar.NULL_INT])
+        self.assertEqual(store.decode('user', nodes['user']), [u'a', None])
+        self.assertEqual([columnar.from_epoch(t) for t in nodes['timestamp']],
+                         ['2016-01-01T00:00:00Z', '2016-01-02T10:20:30Z'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'dictionaries', 'timestamp.json')))
+
+    def test_queries(self):
+        store = self.write([('1', '33.7', '-84.3', 'a', '7', '1', '12', '2016-01-01T00:00:00Z'),
+                            ('2', '33.8', '-84.4', 'b', '8', '1', '13', '2016-01-01T00:00:00Z'),
+                            ('3', '33.9', '-84.5', 'a', '7', '1', '14', '2016-01-01T00:00:00Z')],
+                           [('1', 'amenity', 'cafe', 'regular'),
+                            ('2', 'amenity', 'bank', 'regular'),
+                            ('3', 'amenity', 'cafe', 'regular'),
+                            ('3', 'name', 'Cafe', 'regular')])
+        self.assertEqual(columnar.unique_key(store, tables=('nodes_tags',)), [(u'amenity', 3), (u'name', 1)])
+        self.assertEqual(columnar.top_users(store, tables=('nodes',)), [(u'a', 2), (u'b', 1)])
+        self.assertEqual(columnar.value_counts(store, 'amenity', tables=('nodes_tags',)),
+                         [(u'cafe', 2), (u'bank', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
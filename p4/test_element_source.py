@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Every element_source backend yields the same elements, down to str vs unicode values"""
+
+import unittest
+from cStringIO import StringIO
+
+import element_source
+
+OSM = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lat="33.7" lon="-84.3" user="a" uid="7" version="1" changeset="12" timestamp="2016-01-01T00:00:00Z"/>
+ <node id="2" lat="33.8" lon="-84.4" user="b" uid="8" version="1" changeset="13" timestamp="2016-01-01T00:00:00Z">
+  <tag k="name" v="Caf&#233; &amp; Bar"/>
+  <tag k="amenity" v="cafe"/>
+ </node>
+ <way id="3" user="us\xc3\xa9r" uid="9" version="2" changeset="14" timestamp="2016-01-01T00:00:00Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <tag k="name" v="Ponce de Le&#xF3;n Avenue"/>
+ </way>
+ <relation id="4" user="c" uid="10" version="1" changeset="15" timestamp="2016-01-01T00:00:00Z">
+  <member type="way" ref="3" role="outer"/>
+  <tag k="note" v="&lt;plain&gt;"/>
+ </relation>
+</osm>
+'''
+
+
+def describe(element):
+    """(tag, attrib with value types, children), comparable across backends"""
+
+    attrib = sorted((key, type(value), value) for key, value in element.attrib.items())
+    return element.tag, attrib, [describe(child) for child in element]
+
+
+def parse(backend, tags=element_source.TOP_LEVEL):
+    return [describe(element) for element in element_source.iter_elements(StringIO(OSM), tags, backend)]
+
+
+class BackendTest(unittest.TestCase):
+
+    def test_backends_agree(self):
+        expected = parse('etree')
+        self.assertEqual(len(expected), 4)
+        for backend in element_source.available_backends():
+            self.assertEqual(parse(backend), expected, backend)
+
+    def test_tag_filter(self):
+        expected = parse('etree', ('way',))
+        for backend in element_source.available_backends():
+            self.assertEqual(parse(backend, ('way',)), expected, backend)
+
+    def test_character_references(self):
+        node = parse('expat', ('node',))[1]
+        self.assertEqual(node[2][0][1][1], ('v', unicode, u'Caf\xe9 & Bar'))
+
+    def test_expat_chunk_boundaries(self):
+        # Character references and UTF-8 sequences cut at every possible point
+        expected = parse('etree')
+        for chunk_size in (1, 2, 3, 5, 7, 64):
+            elements = element_source.iter_expat(StringIO(OSM), element_source.TOP_LEVEL, chunk_size)
+            self.assertEqual([describe(element) for element in elements], expected, chunk_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Node stores keep every id they are given, and closed ways lose only their closing node"""
+
+import unittest
+
+import geometry
+
+LOCATIONS = [(-3, '33.70', '-84.30'), (1, '33.71', '-84.31'), (2, '33.72', '-84.32'), (5, '33.75', '-84.35')]
+
+
+class NodeLocationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.memory_nodes = geometry.MEMORY_NODES
+
+    def tearDown(self):
+        geometry.MEMORY_NODES = self.memory_nodes
+
+    def assertStored(self, store):
+        for node_id, lat, lon in LOCATIONS:
+            self.assertEqual(store.get(node_id), (geometry.to_fixed(lat), geometry.to_fixed(lon)))
+        self.assertIsNone(store.get(4))
+        self.assertIsNone(store.get(-4))
+
+    def fill(self, locations):
+        store = geometry.NodeLocations()
+        for node_id, lat, lon in locations:
+            store.add(node_id, lat, lon)
+        return store
+
+    def test_sorted_input_stays_in_memory(self):
+        store = self.fill(LOCATIONS)
+        self.assertIsNone(store.flat)
+        self.assertStored(store)
+
+    def test_unsorted_input_keeps_negative_ids(self):
+        store = self.fill(LOCATIONS[::-1])
+        try:
+            self.assertIsNotNone(store.flat)
+            self.assertStored(store)
+        finally:
+            store.close()
+
+    def test_large_input_moves_to_flat_file(self):
+        geometry.MEMORY_NODES = 2
+        store = self.fill(LOCATIONS)
+        try:
+            self.assertIsNotNone(store.flat)
+            self.assertStored(store)
+        finally:
+            store.close()
+
+
+class WayGeometryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = geometry.NodeLocations()
+        for node_id, lat, lon in [(1, '0', '0'), (2, '0', '2'), (3, '2', '2')]:
+            self.store.add(node_id, lat, lon)
+
+    def centroid(self, refs):
+        return geometry.way_geometry(self.store, refs)[:2]
+
+    def test_closed_way(self):
+        self.assertEqual(self.centroid([1, 2, 3, 1]), self.centroid([1, 2, 3]))
+
+    def test_closed_way_missing_a_middle_node(self):
+        self.assertEqual(self.centroid([1, 2, 9, 3, 1]), self.centroid([1, 2, 3]))
+
+    def test_closed_way_missing_its_closing_node(self):
+        self.assertEqual(self.centroid([9, 1, 2, 3, 9]), self.centroid([1, 2, 3]))
+
+    def test_open_way_missing_its_last_node(self):
+        self.assertEqual(self.centroid([1, 2, 3, 9]), self.centroid([1, 2, 3]))
+
+    def test_missing_nodes(self):
+        self.assertEqual(geometry.way_geometry(self.store, [8, 9]), geometry.NO_GEOMETRY)
+
+
+if __name__ == '__main__':
+    unittest.main()
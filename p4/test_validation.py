@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""The generated fast checks accept exactly the rows the detailed error path accepts"""
+
+import unittest
+
+import validation
+from main import ROW_FIELDS, SCHEMA
+
+NODE = ('1', '33.7', '-84.3', 'a', '7', '1', '12', '2016-01-01T00:00:00Z')
+WAY = ('3', 'a', '7', '1', '12', '2016-01-01T00:00:00Z', 33.7, -84.3, 33.6, -84.4, 33.8, -84.2, 120.5)
+
+
+def slow_ok(key, value):
+    """validate_batch's error path: None if valid"""
+
+    if isinstance(value, list):
+        value = [validation.row_to_dict(row, ROW_FIELDS[key]) for row in value]
+    else:
+        value = validation.row_to_dict(value, ROW_FIELDS[key])
+    return validation._field_errors(key, SCHEMA[key], {key: value}) is None
+
+
+def replace(row, index, value):
+    return row[:index] + (value,) + row[index + 1:]
+
+
+class ValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.checks = validation.compile_schema(SCHEMA, ROW_FIELDS)
+
+    def assertAgree(self, key, value):
+        self.assertEqual(self.checks[key](value), slow_ok(key, value), (key, value))
+
+    def test_id_values(self):
+        for value in ['1', '0042', '-5', ' 12 ', '', '1.5', 'x', u'12', u'٣', 12, 12L, True, False, 1.0, None]:
+            self.assertAgree('node', replace(NODE, 0, value))
+            self.assertAgree('way_nodes', [('3', '1', 0), ('3', value, 1)])
+
+    def test_coordinates(self):
+        for value in ['33.7', '-84', 'nan', '', 'x', 33.7, 3, True, None]:
+            self.assertAgree('node', replace(NODE, 1, value))
+
+    def test_optional_floats(self):
+        for value in [None, 33.7, 3, 3L, True, False, '33.7']:
+            self.assertAgree('way', replace(WAY, 6, value))
+
+    def test_strings(self):
+        for value in ['a', u'us\xe9r', '', None, 7, True]:
+            self.assertAgree('node', replace(NODE, 3, value))
+
+    def test_row_shapes(self):
+        self.assertAgree('node', NODE)
+        self.assertAgree('node', NODE[:-1])
+        self.assertAgree('node', list(NODE))
+        self.assertAgree('node_tags', [])
+        self.assertAgree('node_tags', [('1', 'amenity', 'cafe', 'regular')])
+        self.assertAgree('node_tags', [('1', 'amenity', 'cafe')])
+        self.assertAgree('node_tags', ('1', 'amenity', 'cafe', 'regular'))
+        self.assertTrue(self.checks['node'](NODE))
+        self.assertTrue(self.checks['way'](WAY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Fast replacement for validating shaped elements with cerberus.
+
+compile_schema turns schema.py into one generated check function per top level key.
+Each check is straight-line code (coerce + isinstance per field, looping over the rows
+of list keys) for the common case where the element is valid; only a failing element
+pays for building the detailed, cerberus style error dict that validate_element reports.
+
+Rows are tuples in field list order (None for a missing field), so the schema is
+compiled together with the field list of each top level key.
+"""
+
+import pprint
+
+TYPES = {'integer': (int, long), 'float': (float, int, long), 'string': (basestring,),
+         'dict': (dict,), 'list': (list,)}
+
+SUPPORTED_RULES = set(['type', 'required', 'coerce', 'schema'])
+
+# What these coerce functions return, whatever they are given: int() is always an int
+# (a bool if __int__ says so), float() always a float
+COERCE_RESULTS = {int: (int, long), long: (int, long), float: (float,)}
+
+# A str of ASCII digits always converts with these, so the generated checks skip the call
+DIGITS_COERCE = (int, long)
+DIGITS = '0123456789'
+
+MESSAGE_STRING = "\nElement of type '{0}' has the following errors:\n{1}"
+
+
+def _field_errors(name, rules, document):
+    """Return the cerberus style error list for one field, or None if it is valid"""
+
+    if name not in document:
+        return ['required field'] if rules.get('required') else None
+
+    value = document[name]
+    if 'coerce' in rules:
+        try:
+            value = rules['coerce'](value)
+        except Exception as e:
+            return ["field '{0}' cannot be coerced: {1}".format(name, e)]
+
+    if not isinstance(value, TYPES[rules['type']]) or isinstance(value, bool):
+        return ['must be of {0} type'.format(rules['type'])]
+
+    if 'schema' in rules:
+        errors = explain(rules, value)
+        if errors:
+            return [errors]
+    return None
+
+
+def explain(rules, value):
+    """Build the error dict for a dict or list value that failed its fast check"""
+
+    errors = {}
+    if rules['type'] == 'list':
+        for i, item in enumerate(value):
+            item_errors = _field_errors(i, rules['schema'], {i: item})
+            if item_errors:
+                errors[i] = item_errors
+        return errors
+
+    fields = rules['schema']
+    for name, field_rules in fields.iteritems():
+        field_errors = _field_errors(name, field_rules, value)
+        if field_errors:
+            errors[name] = field_errors
+    for name in value:
+        if name not in fields:
+            errors[name] = ['unknown field']
+    return errors
+
+
+def _check_lines(index, name, rules, namespace):
+    """
+    Return the lines of generated code that return False unless field name (doc[index])
+    passes the same checks as _field_errors: coerce, then isinstance, and no bool where
+    the type would accept one
+    """
+
+    unknown = set(rules) - SUPPORTED_RULES
+    if unknown:
+        raise ValueError('Unsupported schema rules for {0}: {1}'.format(name, sorted(unknown)))
+
+    types = TYPES[rules['type']]
+    coerce = rules.get('coerce')
+    value = 'doc[{0}]'.format(index)
+    lines = []
+    results = None
+    if coerce is not None:
+        coerce_name = '_coerce_{0}'.format(len(namespace))
+        namespace[coerce_name] = coerce
+        lines.append('value = {0}({1})'.format(coerce_name, value))
+        value = 'value'
+        results = COERCE_RESULTS.get(coerce)
+
+    tests = []
+    if results is None or not all(issubclass(result, types) for result in results):
+        types_name = '_types_{0}'.format(rules['type'])
+        namespace[types_name] = types
+        exact = 'str' if issubclass(str, types) else None
+        tests.append('{0}not isinstance({1}, {2})'.format(
+            '{0}.__class__ is not {1} and '.format(value, exact) if exact else '', value, types_name))
+    if issubclass(bool, types if results is None else results):
+        tests.append('{0} is True or {0} is False'.format(value))
+    if tests:
+        lines.append('if {0}:'.format(' or '.join(tests)))
+        lines.append('    return False')
+
+    if coerce in DIGITS_COERCE:
+        namespace['_digits'] = DIGITS
+        lines = (['value = doc[{0}]'.format(index),
+                  'if value.__class__ is not str or not value or value.strip(_digits):'] +
+                 ['    ' + line.replace('doc[{0}]'.format(index), 'value') for line in lines])
+
+    if not rules.get('required'):
+        lines = ['if doc[{0}] is not None:'.format(index)] + ['    ' + line for line in lines]
+    return lines
+
+
+def compile_rules(rules, fields):
+    """
+    Generate the fast check for a row (or list of rows) schema entry. A list is checked
+    by a loop inside the generated function, so a row costs no call of its own.
+    """
+
+    namespace = {}
+    schema = rules['schema']
+    if rules['type'] == 'list':
+        schema = schema['schema']
+
+    if set(schema) != set(fields):
+        raise ValueError('Field list {0} does not match schema {1}'.format(fields, sorted(schema)))
+
+    lines = ['if not isinstance(doc, tuple) or len(doc) != {0}:'.format(len(fields)),
+             '    return False']
+    for i, name in enumerate(fields):
+        lines.extend(_check_lines(i, name, schema[name], namespace))
+
+    if rules['type'] == 'list':
+        head = ['def check(rows):',
+                '    if not isinstance(rows, list):',
+                '        return False',
+                '    try:',
+                '        for doc in rows:']
+        indent = ' ' * 12
+    else:
+        head = ['def check(doc):',
+                '    try:']
+        indent = ' ' * 8
+    tail = ['    except Exception:',
+            '        return False',
+            '    return True']
+    source = '\n'.join(head + [indent + line for line in lines] + tail) + '\n'
+    exec compile(source, '<schema>', 'exec') in namespace
+    return namespace['check']
+
+
+def compile_schema(schema, fields):
+    """Compile every top level key of schema.py once, at startup. fields maps key -> field list"""
+
+    return dict((key, compile_rules(rules, fields[key])) for key, rules in schema.iteritems())
+
+
+def row_to_dict(row, fields):
+    """Turn a row tuple back into the dict cerberus would have seen, for error reporting"""
+
+    if not isinstance(row, tuple) or len(row) != len(fields):
+        return row
+    return dict((field, value) for field, value in zip(fields, row) if value is not None)
+
+
+def validate_batch(elements, checks, schema, fields):
+    """Raise an Exception formatted like validate_element for the first invalid element"""
+
+    for element in elements:
+        for field, value in element.iteritems():
+            if field in checks and checks[field](value):
+                continue
+
+            if field not in schema:
+                errors = ['unknown field']
+            else:
+                if isinstance(value, list):
+                    value = [row_to_dict(row, fields[field]) for row in value]
+                else:
+                    value = row_to_dict(value, fields[field])
+                errors = _field_errors(field, schema[field], {field: value})
+            if errors:
+                raise Exception(MESSAGE_STRING.format(field, pprint.pformat(errors)))
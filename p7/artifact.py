@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+""" single versioned bundle for the classifier, dataset and feature list
+
+    a bundle is a directory holding
+        manifest.json   format version, feature list, employee names, column
+                        kinds, text columns and a sha1 of every other file
+        features.npy    featureFormat(dataset, feature_list, sort_keys=True),
+                        the matrix tester.py evaluates
+        dataset.npy     every numeric column of the dataset (NaN = missing),
+                        one row per employee in sorted order
+        classifier.pkl  the fitted classifier, binary pickle
+
+    both .npy files are opened with mmap_mode='r', so evaluator processes
+    and the scoring service share the pages instead of each unpickling a
+    copy of the dataset dict. the classifier is checked against its sha1
+    before it is unpickled.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../tools/"))
+from feature_format import featureFormat
+
+ARTIFACT_VERSION = 1
+MANIFEST = "manifest.json"
+FEATURES = "features.npy"
+DATASET = "dataset.npy"
+CLASSIFIER = "classifier.pkl"
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _column_kind(values):
+    """ 'bool', 'int', 'float' or 'text' for the non-'NaN' values of a column """
+    values = [v for v in values if v != 'NaN']
+    if all(isinstance(v, bool) for v in values):
+        return 'bool'
+    if all(isinstance(v, (int, long)) and not isinstance(v, bool) for v in values):
+        return 'int'
+    if all(isinstance(v, (int, long, float)) for v in values):
+        return 'float'
+    return 'text'
+
+
+def split_dataset(dataset):
+    """ dataset dict -> (employees, numeric column kinds, numeric matrix, text columns) """
+    employees = sorted(dataset)
+    columns = sorted(set(feature for key in employees for feature in dataset[key]))
+    kinds = []
+    text = {}
+    for column in columns:
+        values = [dataset[key].get(column, 'NaN') for key in employees]
+        kind = _column_kind(values)
+        if kind == 'text':
+            text[column] = values
+        else:
+            kinds.append((column, kind))
+
+    matrix = np.empty((len(employees), len(kinds)), dtype = np.float64)
+    for j, (column, _) in enumerate(kinds):
+        for i, key in enumerate(employees):
+            value = dataset[key].get(column, 'NaN')
+            matrix[i, j] = np.nan if value == 'NaN' else float(value)
+    return employees, kinds, matrix, text
+
+
+def dump_artifact(path, clf, dataset, feature_list):
+    """ write the bundle to path; a previous bundle there is renamed aside, replaced
+        by the new one and only then removed, so path never holds a partial bundle """
+    employees, kinds, matrix, text = split_dataset(dataset)
+    tmp = "{0}.{1}.tmp".format(path.rstrip(os.sep), os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    np.save(os.path.join(tmp, FEATURES), featureFormat(dataset, feature_list, sort_keys = True))
+    np.save(os.path.join(tmp, DATASET), matrix)
+    with open(os.path.join(tmp, CLASSIFIER), "wb") as f:
+        pickle.dump(clf, f, pickle.HIGHEST_PROTOCOL)
+
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'feature_list': list(feature_list),
+        'employees': employees,
+        'columns': kinds,
+        'text_columns': text,
+        'sha1': dict((name, file_sha1(os.path.join(tmp, name)))
+                     for name in (FEATURES, DATASET, CLASSIFIER)),
+    }
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+
+    old = None
+    if os.path.exists(path):
+        old = "{0}.{1}.old".format(path.rstrip(os.sep), os.getpid())
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if old is not None:
+        shutil.rmtree(old)
+
+
+class Artifact(object):
+    """ an opened bundle; arrays are memory-mapped, the classifier is unpickled on first use """
+    def __init__(self, path, verify = False):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise ArtifactError("no artifact bundle at {0}".format(path))
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != ARTIFACT_VERSION:
+            raise ArtifactError("artifact version {0}, expected {1}".format(
+                self.manifest.get('version'), ARTIFACT_VERSION))
+
+        self.feature_list = [str(feature) for feature in self.manifest['feature_list']]
+        self.features_path = os.path.join(path, FEATURES)
+        if verify:
+            for name in (FEATURES, DATASET):
+                self._check(name)
+        self.features = np.load(self.features_path, mmap_mode = "r")
+        self.data = np.load(os.path.join(path, DATASET), mmap_mode = "r")
+        self._clf = None
+
+    def _check(self, name):
+        if file_sha1(os.path.join(self.path, name)) != self.manifest['sha1'][name]:
+            raise ArtifactError("checksum mismatch for {0} in {1}".format(name, self.path))
+
+    @property
+    def clf(self):
+        if self._clf is None:
+            self._check(CLASSIFIER)
+            with open(os.path.join(self.path, CLASSIFIER), "rb") as f:
+                self._clf = pickle.load(f)
+        return self._clf
+
+    @property
+    def employees(self):
+        return [str(key) for key in self.manifest['employees']]
+
+    @property
+    def columns(self):
+        return [str(column) for column, _ in self.manifest['columns']]
+
+    def column(self, name):
+        """ one numeric column as a memory-mapped vector, NaN where missing """
+        return self.data[:, self.columns.index(name)]
+
+    def dataset(self):
+        """ rebuild the {employee: {feature: value}} dict written by dump_artifact """
+        casts = {'bool': bool, 'int': int, 'float': float}
+        kinds = [(str(column), casts[kind]) for column, kind in self.manifest['columns']]
+        text = dict((str(column), values) for column, values in self.manifest['text_columns'].items())
+        dataset = {}
+        for i, key in enumerate(self.employees):
+            record = {}
+            for j, (column, cast) in enumerate(kinds):
+                value = self.data[i, j]
+                record[column] = 'NaN' if np.isnan(value) else cast(value)
+            for column, values in text.items():
+                value = values[i]
+                record[column] = value.encode('utf-8') if isinstance(value, unicode) else value
+            dataset[key] = record
+        return dataset
+
+
+def load_artifact(path, verify = False):
+    return Artifact(path, verify = verify)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+""" cache for featureFormat output, keyed by the dataset values it reads
+
+    cached_feature_format(dataset, features_list, **kwargs) returns the same
+    values as featureFormat(dataset, features_list, **kwargs). the array is
+    stored column by column (fortran order .npy) under a hash of the sorted
+    (name, feature values) rows, the feature list and the featureFormat
+    arguments, so any edit to the dict or the feature list invalidates it.
+    the array comes back memory-mapped read-only whether it was just written
+    or already there.
+
+    the rows are hashed as one repr, without the per-value float conversion
+    and zero checks featureFormat does. an optional version string is mixed
+    into the key as well.
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../tools/"))
+from feature_format import featureFormat
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_cache")
+
+
+def dataset_key(dataset, features_list, version = None, **kwargs):
+    features_list = list(features_list)
+    digest = hashlib.sha1(repr((version, features_list, sorted(kwargs.items()))))
+    digest.update(repr([(key, map(dataset[key].get, features_list)) for key in sorted(dataset)]))
+    return digest.hexdigest()[:20]
+
+
+def cached_feature_format(dataset, features_list, version = None, cache_dir = CACHE_DIR, **kwargs):
+    key = dataset_key(dataset, features_list, version, **kwargs)
+    path = os.path.join(cache_dir, "features_{0}.npy".format(key))
+    if not os.path.exists(path):
+        data = featureFormat(dataset, features_list, **kwargs)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        ### write under a temporary name first so a reader never sees half a file
+        tmp = "{0}.{1}.npy".format(path[:-4], os.getpid())
+        np.save(tmp, np.asfortranarray(data))
+        os.rename(tmp, path)
+    return np.load(path, mmap_mode = "r")
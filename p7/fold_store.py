@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+""" precomputed StratifiedShuffleSplit folds, cached on disk
+
+    the train/test index arrays for a (labels, n_folds, test_size, seed)
+    combination are computed once and saved as two .npy matrices (one row
+    per fold). later runs, and every worker process, open them with
+    mmap_mode='r' so the folds are shared instead of recomputed or copied.
+
+    a FoldStore can be passed anywhere a cv iterator is expected, e.g.
+    GridSearchCV(cv=...), and iterated as many times as needed.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import sklearn
+from sklearn.cross_validation import StratifiedShuffleSplit
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fold_cache")
+
+
+class FoldStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.train = np.load(path + "_train.npy", mmap_mode = "r")
+        self.test = np.load(path + "_test.npy", mmap_mode = "r")
+
+    def __len__(self):
+        return self.train.shape[0]
+
+    def __getitem__(self, i):
+        return self.train[i], self.test[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.train[i], self.test[i]
+
+
+def fold_key(labels, n_folds, test_size, seed):
+    """ content hash of the labels plus everything that changes the splits """
+    labels = np.ascontiguousarray(labels, dtype = np.float64)
+    digest = hashlib.sha1(labels.tostring())
+    digest.update("{0}|{1}|{2}|{3}".format(n_folds, test_size, seed, sklearn.__version__))
+    return digest.hexdigest()[:16]
+
+
+def _index_dtype(n):
+    for dtype in (np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def stratified_folds(labels, n_folds, test_size = 0.1, seed = 42, cache_dir = CACHE_DIR):
+    """ return the FoldStore for these labels/parameters, building it on first use """
+    path = os.path.join(cache_dir, "folds_" + fold_key(labels, n_folds, test_size, seed))
+    if not os.path.exists(path + "_test.npy"):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        cv = StratifiedShuffleSplit(labels, n_folds, test_size = test_size, random_state = seed)
+        dtype = _index_dtype(len(labels))
+        folds = list(cv)
+        train = np.array([train_idx for train_idx, _ in folds], dtype = dtype)
+        test = np.array([test_idx for _, test_idx in folds], dtype = dtype)
+
+        ### write under a temporary name first so a reader never sees half a store
+        tmp = "{0}.{1}".format(path, os.getpid())
+        np.save(tmp + "_train.npy", train)
+        np.save(tmp + "_test.npy", test)
+        os.rename(tmp + "_train.npy", path + "_train.npy")
+        os.rename(tmp + "_test.npy", path + "_test.npy")
+
+    return FoldStore(path)
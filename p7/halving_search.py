@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+""" successive-halving parameter search, a drop-in for GridSearchCV
+
+    every parameter combination is first scored on a few cv folds; only the
+    best 1/factor of them move on to the next round, which uses factor times
+    as many folds, until the survivors are scored on every fold. scores from
+    earlier rounds are kept, so no (params, fold) pair is fit twice.
+    min_folds = None scores every combination on every fold with no halving,
+    an exhaustive grid search that still uses the score cache.
+
+    the interface follows GridSearchCV: pass the Pipeline, the parameters
+    dict and the cv folds, call fit(), then read best_params_,
+    best_score_ and best_estimator_.
+
+    with cache_dir set, every (params, fold) score is also kept on disk
+    (search_cache.ScoreCache), so a re-run after editing the grid only fits
+    the new points. sklearn 0.18 Pipelines have no memory argument; instead,
+    with cache_transforms the fitted first step of a Pipeline (SelectKBest)
+    and its transformed folds are reused by every candidate that shares
+    that step's parameters. that reuse is a dict in this process: with
+    n_jobs > 1 each worker gets its own copy and nothing is shared, so it
+    only saves fits when n_jobs = 1.
+"""
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.externals.joblib import Parallel, delayed
+from sklearn.grid_search import ParameterGrid
+from sklearn.metrics.scorer import check_scoring
+from sklearn.pipeline import Pipeline
+
+from search_cache import CACHE_DIR, ScoreCache, describe
+
+
+def _transformed_fold(estimator, X, y, train, test, fold, transforms):
+    """
+    fit the first step of the Pipeline on the training fold and transform both
+    halves, or reuse the result of an earlier candidate with the same step params
+    """
+    name, step = estimator.steps[0]
+    key = (fold, describe(step))
+    if key not in transforms:
+        step.fit(X[train], y[train])
+        transforms[key] = (step.transform(X[train]), step.transform(X[test]))
+    return transforms[key]
+
+
+def _fit_and_score(estimator, params, X, y, train, test, scoring, error_score,
+                   fold = None, transforms = None):
+    estimator = clone(estimator).set_params(**params)
+    try:
+        if transforms is not None and isinstance(estimator, Pipeline) and len(estimator.steps) > 1:
+            X_train, X_test = _transformed_fold(estimator, X, y, train, test, fold, transforms)
+            rest = estimator.steps[1:]
+            estimator = rest[0][1] if len(rest) == 1 else Pipeline(rest)
+            estimator.fit(X_train, y[train])
+            return check_scoring(estimator, scoring = scoring)(estimator, X_test, y[test])
+        estimator.fit(X[train], y[train])
+        return check_scoring(estimator, scoring = scoring)(estimator, X[test], y[test])
+    except Exception:
+        if error_score == 'raise':
+            raise
+        return error_score
+
+
+class HalvingGridSearch(object):
+    def __init__(self, estimator, param_grid, scoring = None, cv = None, factor = 3,
+                 min_folds = 5, error_score = 0, n_jobs = 1, refit = True, verbose = 0,
+                 cache_dir = None, cache_transforms = True):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.factor = factor
+        self.min_folds = min_folds
+        self.error_score = error_score
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.verbose = verbose
+        self.cache_dir = cache_dir
+        self.cache_transforms = cache_transforms
+
+    def fit(self, X, y):
+        X = np.asarray(X)
+        y = np.asarray(y)
+        folds = list(self.cv)
+        candidates = list(ParameterGrid(self.param_grid))
+
+        cache = None
+        if self.cache_dir is not None:
+            cache = ScoreCache.for_search(self.estimator, X, y, folds, self.scoring, self.cache_dir)
+        ### fitted first Pipeline steps per (fold, step params); shared in-process only
+        transforms = {} if self.cache_transforms else None
+
+        def score_jobs(jobs):
+            """ scores of the (candidate, fold) jobs, fitting only those not in the cache """
+            cached = [cache.get(candidates[i], f) if cache else None for i, f in jobs]
+            todo = [job for job, score in zip(jobs, cached) if score is None]
+            results = Parallel(n_jobs = self.n_jobs)(
+                delayed(_fit_and_score)(self.estimator, candidates[i], X, y, folds[f][0], folds[f][1],
+                                        self.scoring, self.error_score, f, transforms)
+                for i, f in todo)
+            fitted = dict(zip(todo, results))
+            if cache:
+                for (i, f), score in fitted.items():
+                    cache.put(candidates[i], f, score)
+                cache.save()
+            self.n_fits_ += len(todo)
+            return [fitted[job] if score is None else score for job, score in zip(jobs, cached)]
+
+        ### scores[i] holds the fold scores of candidate i computed so far
+        scores = [[] for _ in candidates]
+        survivors = range(len(candidates))
+        n_folds = len(folds) if self.min_folds is None else min(self.min_folds, len(folds))
+        self.rounds_ = []
+        self.n_fits_ = 0
+
+        while True:
+            jobs = [(i, f) for i in survivors for f in range(len(scores[i]), n_folds)]
+            for (i, _), score in zip(jobs, score_jobs(jobs)):
+                scores[i].append(score)
+
+            self.rounds_.append((len(survivors), n_folds))
+            if self.verbose:
+                print "Halving round: {0} candidates on {1} folds".format(len(survivors), n_folds)
+            if n_folds == len(folds) or len(survivors) == 1:
+                break
+
+            ### keep the best 1/factor; ties keep grid order like GridSearchCV
+            ranked = sorted(survivors, key = lambda i: (-np.mean(scores[i]), i))
+            survivors = sorted(ranked[:max(1, len(ranked) // self.factor)])
+            n_folds = min(n_folds * self.factor, len(folds))
+
+        ### the last survivor(s) are always scored on every fold
+        jobs = [(i, f) for i in survivors for f in range(len(scores[i]), len(folds))]
+        for (i, _), score in zip(jobs, score_jobs(jobs)):
+            scores[i].append(score)
+
+        best = sorted(survivors, key = lambda i: (-np.mean(scores[i]), i))[0]
+        self.candidates_ = candidates
+        self.scores_ = scores
+        self.best_params_ = candidates[best]
+        self.best_score_ = np.mean(scores[best])
+        self.n_scores_ = sum(len(s) for s in scores)
+        if cache:
+            self.cache_hits_ = cache.hits
+
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
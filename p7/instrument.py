@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+""" named timers and counters for the model-selection workflow
+
+    a Profiler collects wall-clock samples per named stage and plain
+    counters, then produces a json-able report and a summary table:
+
+        with PROFILER.timer('featureFormat'):
+            data = featureFormat(...)
+        PROFILER.start('grid_search.fit'); ...; PROFILER.stop('grid_search.fit')
+        PROFILER.add_time('fold.fit', seconds)      # samples timed elsewhere
+        PROFILER.count('folds')
+
+    the module-level start/stop/timer/count/add_time functions use the shared
+    PROFILER. profile() (or start_cprofile/stop_cprofile in a flat script)
+    runs code under cProfile, writes the .prof file and keeps the top
+    functions by cumulative time in the report.
+"""
+
+import cProfile
+import json
+import pstats
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Profiler(object):
+    def __init__(self):
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+        self.running = {}
+        self.cprofile = None
+        self._cprofiler = None
+
+    def start(self, name):
+        self.running[name] = time.time()
+
+    def stop(self, name):
+        elapsed = time.time() - self.running.pop(name)
+        self.add_time(name, elapsed)
+        return elapsed
+
+    @contextmanager
+    def timer(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def add_time(self, name, seconds):
+        self.timers.setdefault(name, []).append(seconds)
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def start_cprofile(self):
+        self._cprofiler = cProfile.Profile()
+        self._cprofiler.enable()
+
+    def stop_cprofile(self, path, top = 20):
+        """ stats go to path; the top functions by cumulative time go to the report """
+        profiler = self._cprofiler
+        profiler.disable()
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler).sort_stats('cumulative')
+        rows = []
+        for func in stats.fcn_list[:top]:
+            calls, _, tottime, cumtime, _ = stats.stats[func]
+            rows.append({'function': "{0}:{1}({2})".format(*func), 'calls': calls,
+                         'tottime': tottime, 'cumtime': cumtime})
+        self.cprofile = {'path': path, 'top': rows}
+
+    @contextmanager
+    def profile(self, path, top = 20):
+        """ run the block under cProfile """
+        self.start_cprofile()
+        try:
+            yield
+        finally:
+            self.stop_cprofile(path, top)
+
+    def report(self):
+        timers = OrderedDict()
+        for name, samples in self.timers.items():
+            samples = np.array(samples)
+            timers[name] = {
+                'count': len(samples),
+                'total': float(samples.sum()),
+                'mean': float(samples.mean()),
+                'p50': float(np.percentile(samples, 50)),
+                'max': float(samples.max()),
+            }
+        report = OrderedDict([('timers', timers), ('counters', self.counters)])
+        if self.cprofile is not None:
+            report['cprofile'] = self.cprofile
+        return report
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent = 2)
+
+    def summary(self):
+        """ fixed-width table of the timers, then the counters """
+        report = self.report()
+        width = max([len(name) for name in report['timers']] + [len('stage')])
+        lines = ["{0:<{w}}  {1:>6}  {2:>10}  {3:>10}  {4:>10}".format(
+            'stage', 'count', 'total s', 'mean ms', 'max ms', w = width)]
+        for name, t in report['timers'].items():
+            lines.append("{0:<{w}}  {1:>6d}  {2:>10.3f}  {3:>10.2f}  {4:>10.2f}".format(
+                name, t['count'], t['total'], t['mean'] * 1000, t['max'] * 1000, w = width))
+        for name, value in report['counters'].items():
+            lines.append("{0:<{w}}  {1:>6}".format(name, value, w = width))
+        return "\n".join(lines)
+
+
+PROFILER = Profiler()
+
+start = PROFILER.start
+stop = PROFILER.stop
+timer = PROFILER.timer
+add_time = PROFILER.add_time
+count = PROFILER.count
@@ -9,6 +9,8 @@ sys.path.append("../tools/")
 
 from feature_format import featureFormat, targetFeatureSplit
 from tester import dump_classifier_and_data
+import transform
+import outlier_scan
 
 
 with open("final_project_dataset.pkl", "r") as data_file:
@@ -16,17 +18,14 @@ with open("final_project_dataset.pkl", "r") as data_file:
 
 
 # Create the data structure using Pandas Dataframe
+# (real NaNs, float columns; same loader as poi_id.py)
 
-df = DataFrame.from_dict(data_dict, orient='index')
+df = transform.load_frame(data_dict)
 
-float_list = ['salary', 'deferral_payments', 'total_payments', 
-'loan_advances', 'bonus', 'restricted_stock_deferred', 'deferred_income', 
-'total_stock_value', 'expenses', 'exercised_stock_options', 'other', 
-'long_term_incentive', 'restricted_stock', 'director_fees', 
-'to_messages', 'from_poi_to_this_person', 'from_messages', 
-'from_this_person_to_poi', 'shared_receipt_with_poi']
+###	Rank suspicious rows over every numeric column in one scan
+###	(robust z-scores; TOTAL-like aggregate and empty rows are flagged)
 
-df[float_list] = df[float_list].astype(float)
+outlier_scan.print_suspects(outlier_scan.scan_dict(data_dict))
 
 ###	Plot histogram for salary and inspect for outliers
 
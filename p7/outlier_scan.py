@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+""" streaming outlier scan over every numeric column of the enron records
+
+    pass 1 keeps, per column, a count, a sum and a fixed-size quantile sketch
+    (exact until the column has more than `sketch_size` values, approximate
+    after that), so memory does not grow with the number of rows. the
+    sketch gives the median and MAD of every column.
+
+    pass 2 scores each row with robust z-scores, 0.6745 * (x - median) / MAD,
+    and keeps the `top` most extreme rows in a heap. two kinds of rows are
+    flagged outright:
+        aggregate   the value is (about) the sum of all the other rows, on
+                    most of its columns, like the spreadsheet's TOTAL line
+        empty       no numeric value at all
+
+    records come from a callable returning a fresh iterator of
+    (name, {feature: value}) pairs, so both passes can re-read a file that
+    does not fit in memory:
+
+        python outlier_scan.py final_project_dataset.pkl
+        python outlier_scan.py --top 30 employees.jsonl
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import math
+import pickle
+import random
+from collections import namedtuple
+
+import transform
+
+Suspect = namedtuple('Suspect', ['name', 'score', 'column', 'n_extreme', 'flags'])
+
+Z_THRESHOLD = 3.5
+SKETCH_SIZE = 200
+AGGREGATE_TOLERANCE = 0.01
+
+
+class QuantileSketch(object):
+    """
+    compacting sketch: a full level is sorted and every other value moves up
+    a level with twice the weight. exact while all values fit in level 0.
+    """
+    def __init__(self, k = SKETCH_SIZE, seed = 0):
+        self.k = k
+        self.levels = [[]]
+        self.rng = random.Random(seed)
+        self.n = 0
+
+    def add(self, x):
+        self.levels[0].append(x)
+        self.n += 1
+        if len(self.levels[0]) >= self.k:
+            self._compact(0)
+
+    def _compact(self, h):
+        values = sorted(self.levels[h])
+        self.levels[h] = []
+        if h + 1 == len(self.levels):
+            self.levels.append([])
+        self.levels[h + 1].extend(values[self.rng.randint(0, 1)::2])
+        if len(self.levels[h + 1]) >= self.k:
+            self._compact(h + 1)
+
+    def weighted(self, key = None):
+        items = [(x if key is None else key(x), 2 ** h)
+                 for h, level in enumerate(self.levels) for x in level]
+        items.sort()
+        return items
+
+    def quantile(self, q, key = None):
+        items = self.weighted(key)
+        if not items:
+            return float('nan')
+        total = sum(w for _, w in items)
+        seen = 0
+        for value, weight in items:
+            seen += weight
+            if seen >= q * total:
+                return value
+        return items[-1][0]
+
+
+class ColumnStats(object):
+    def __init__(self, sketch_size = SKETCH_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.sketch = QuantileSketch(sketch_size)
+        self.median = self.mad = None
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        self.sketch.add(x)
+
+    def finalize(self):
+        self.median = self.sketch.quantile(0.5)
+        median = self.median
+        self.mad = self.sketch.quantile(0.5, key = lambda x: abs(x - median))
+
+    def z(self, x):
+        if not self.mad:
+            return 0.0
+        return 0.6745 * (x - self.median) / self.mad
+
+
+def numeric(value):
+    """ float of a record value, None when missing or not a number """
+    if value is None or value == 'NaN' or value == '' or isinstance(value, bool):
+        return None
+    try:
+        x = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(x) else x
+
+
+class OutlierScan(object):
+    def __init__(self, columns = transform.NUMERIC_FEATURES, top = 20, z_threshold = Z_THRESHOLD,
+                 sketch_size = SKETCH_SIZE, aggregate_tolerance = AGGREGATE_TOLERANCE):
+        self.columns = list(columns)
+        self.top = top
+        self.z_threshold = z_threshold
+        self.aggregate_tolerance = aggregate_tolerance
+        self.stats = dict((column, ColumnStats(sketch_size)) for column in self.columns)
+        self.rows = 0
+
+    def update(self, record):
+        """ pass 1 """
+        self.rows += 1
+        for column in self.columns:
+            x = numeric(record.get(column))
+            if x is not None:
+                self.stats[column].add(x)
+
+    def finalize(self):
+        for stats in self.stats.values():
+            stats.finalize()
+
+    def score(self, name, record):
+        """ pass 2: Suspect for one row """
+        best_z, best_column, n_extreme, n_values, n_aggregate = 0.0, None, 0, 0, 0
+        for column in self.columns:
+            x = numeric(record.get(column))
+            if x is None:
+                continue
+            n_values += 1
+            stats = self.stats[column]
+            z = abs(stats.z(x))
+            if z > self.z_threshold:
+                n_extreme += 1
+            if z > best_z:
+                best_z, best_column = z, column
+            rest = stats.total - x
+            if rest and abs(x - rest) <= self.aggregate_tolerance * abs(rest):
+                n_aggregate += 1
+
+        flags = []
+        if n_values and n_aggregate * 2 > n_values:
+            flags.append('aggregate')
+        if not n_values:
+            flags.append('empty')
+        return Suspect(name, best_z, best_column, n_extreme, tuple(flags))
+
+    def run(self, source):
+        """ both passes over source(); flagged rows first, then the top rows by score """
+        for _, record in source():
+            self.update(record)
+        self.finalize()
+
+        flagged = []
+        heap = []
+        for name, record in source():
+            suspect = self.score(name, record)
+            if suspect.flags:
+                flagged.append(suspect)
+            elif len(heap) < self.top:
+                heapq.heappush(heap, (suspect.score, suspect))
+            elif suspect.score > heap[0][0]:
+                heapq.heapreplace(heap, (suspect.score, suspect))
+        ranked = sorted((suspect for _, suspect in heap), key = lambda s: -s.score)
+        return sorted(flagged, key = lambda s: -s.score) + ranked
+
+
+def flagged_rows(suspects):
+    """ names of the rows flagged as aggregates or empty """
+    return [suspect.name for suspect in suspects if suspect.flags]
+
+
+def scan_dict(data_dict, **kwargs):
+    return OutlierScan(**kwargs).run(lambda: data_dict.iteritems())
+
+
+def pickle_source(path):
+    def source():
+        with open(path, "r") as f:
+            for item in pickle.load(f).iteritems():
+                yield item
+    return source
+
+
+def jsonl_source(path, name_field = 'name'):
+    def source():
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get(name_field), record
+    return source
+
+
+def csv_source(path, name_field = 'name'):
+    def source():
+        with open(path) as f:
+            for record in csv.DictReader(f):
+                yield record.get(name_field), record
+    return source
+
+
+def print_suspects(suspects):
+    print "{0:<32} {1:>10}  {2:<26} {3:>7}  {4}".format('name', 'max |z|', 'column', 'extreme', 'flags')
+    for s in suspects:
+        print "{0:<32} {1:>10.1f}  {2:<26} {3:>7d}  {4}".format(
+            s.name, s.score, s.column or '', s.n_extreme, ", ".join(s.flags))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Rank suspicious rows by robust z-scores.")
+    parser.add_argument('input', nargs = '?', default = "final_project_dataset.pkl",
+                        help = "pickled data dict, json lines or csv (with a name column)")
+    parser.add_argument('--top', type = int, default = 20)
+    parser.add_argument('--threshold', type = float, default = Z_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.input.endswith(('.jsonl', '.json')):
+        source = jsonl_source(args.input)
+    elif args.input.endswith('.csv'):
+        source = csv_source(args.input)
+    else:
+        source = pickle_source(args.input)
+    print_suspects(OutlierScan(top = args.top, z_threshold = args.threshold).run(source))
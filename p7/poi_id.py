@@ -10,8 +10,19 @@ from collections import defaultdict
 
 sys.path.append("../tools/")
 
-from feature_format import featureFormat, targetFeatureSplit
+from feature_format import targetFeatureSplit
 from tester import dump_classifier_and_data
+from feature_cache import cached_feature_format
+import transform
+import outlier_scan
+import instrument
+
+# Stage timings are printed at the end and written to profile_report;
+# set cprofile to True to also capture poi_id.prof with cProfile
+profile_report = "poi_id_profile.json"
+cprofile = False
+if cprofile:
+    instrument.PROFILER.start_cprofile()
 
 
 #Task 1: Select what features you'll use.
@@ -44,70 +55,45 @@ features_list = ['poi',
 				]
 
 ### Load the dictionary containing the dataset
+instrument.start('load_data')
 with open("final_project_dataset.pkl", "r") as data_file:
     data_dict = pickle.load(data_file)
+instrument.stop('load_data')
 
 
-#Task 2: Remove outliers
-
-data_dict.pop( "TOTAL", 0 )
-data_dict.pop( "THE TRAVEL AGENCY IN THE PARK", 0)
-
-f_list = ['salary', 'bonus', 'long_term_incentive', 'deferred_income', 'deferral_payments', 
-'loan_advances', 'other', 'expenses', 'director_fees', 'total_payments', 'exercised_stock_options', 
-'restricted_stock', 'restricted_stock_deferred', 'total_stock_value']
-
-for employee, feature in data_dict.iteritems():
+#Task 2: Remove outliers, and repair the rows shifted by one column
+# (see outlier_scan.py and transform.ROW_CORRECTIONS). Rows flagged by the
+# scan (aggregates like TOTAL, empty rows) are dropped, plus the known
+# non-employee rows the numbers cannot tell apart.
 
-	if employee == 'BHATNAGAR SANJAY':
-		j=len(f_list)-1
-		while j >= 0:
-			feature[f_list[j]] = feature[f_list[j-1]]
-			j-=1
-		feature['salary'] = 'NaN'
+instrument.start('outliers')
+suspects = outlier_scan.scan_dict(data_dict, top = 10)
+print "Outlier Scan: "
+outlier_scan.print_suspects(suspects)
+print "\n"
+outliers = outlier_scan.flagged_rows(suspects) + transform.NON_EMPLOYEES
 
-	if employee == 'BELFER ROBERT':
-		i=3
-		while i < len(f_list)-1:
-			feature[f_list[i]] = feature[f_list[i+1]]
-			i+=1
-		feature[f_list[i]] = 'NaN'
+df = transform.load_frame(data_dict)
+df = transform.drop_outliers(df, outliers)
+df = transform.apply_corrections(df)
+instrument.stop('outliers')
 
 	
 #Task 3: Create new feature(s)
+# received_from_poi_ratio, sent_to_poi_ratio and shared_receipt_with_poi_ratio;
+# register more with transform.register_ratio / transform.register_feature
 
-e_list = ['to_messages', 'from_messages', 'from_poi_to_this_person', 'from_this_person_to_poi',
-'shared_receipt_with_poi', 'received_from_poi_ratio', 'sent_to_poi_ratio']
-
-
-for employee, feature in data_dict.iteritems():
+instrument.start('new_features')
+df = transform.add_derived_features(df)
 
-	# 'from_poi_to_this_person' to 'to_messages' ratio
-	if feature['from_poi_to_this_person'] == 'NaN' or feature['to_messages'] == 'NaN':
-		feature['received_from_poi_ratio'] = 'NaN'
-	else:
-		feature['received_from_poi_ratio'] = \
-			float(feature['from_poi_to_this_person']) / float(feature['to_messages'])
 
-	# 'from_this_person_to_poi' to 'from_messages' ratio
-	if feature['from_this_person_to_poi'] == 'NaN' or feature['from_messages'] == 'NaN':
-		feature['sent_to_poi_ratio'] = 'NaN'
-	else:
-		feature['sent_to_poi_ratio'] = \
-			float(feature['from_this_person_to_poi']) / float(feature['from_messages'])
-
-	# 'shared_receipt_with_poi_ratio' to 'to_messages' ratio
-	if feature['shared_receipt_with_poi'] == 'NaN' or feature['to_messages'] == 'NaN':
-		feature['shared_receipt_with_poi_ratio'] = 'NaN'
-	else:
-		feature['shared_receipt_with_poi_ratio'] = \
-			float(feature['shared_receipt_with_poi']) / float(feature['to_messages'])
-
-
-my_dataset = data_dict
+my_dataset = transform.to_data_dict(df)
+instrument.stop('new_features')
 
 ### Extract features and labels from dataset for local testing
-data = featureFormat(my_dataset, features_list, sort_keys = True)
+instrument.start('featureFormat')
+data = cached_feature_format(my_dataset, features_list, sort_keys = True)
+instrument.stop('featureFormat')
 labels, features = targetFeatureSplit(data)
 
 
@@ -197,28 +183,48 @@ parameters = dict(
 ### stratified shuffle split cross validation. For more info: 
 ### http://scikit-learn.org/stable/modules/generated/sklearn.cross_validation.StratifiedShuffleSplit.html
 
-from sklearn.cross_validation import train_test_split, StratifiedShuffleSplit
-from sklearn.grid_search import GridSearchCV
+from sklearn.cross_validation import train_test_split
+from fold_store import stratified_folds
+from halving_search import HalvingGridSearch
+import search_cache
 from operator import itemgetter
 
 # Create training sets and test sets
 features_train, features_test, labels_train, labels_test = train_test_split(features, labels, test_size=0.3, random_state=42)
 
 # Cross-validation for parameter tuning in grid search 
-scv = StratifiedShuffleSplit(
+# (folds are computed once and reused from fold_cache/ on later runs)
+scv = stratified_folds(
     labels_train,
-    n_iter = 20,
+    n_folds = 20,
     test_size = 0.5,
-    random_state = 42
+    seed = 42
     )
 
+# Successive halving drops weak parameter combinations after a few folds and
+# only gives the survivors all 20; set to False for an exhaustive search
+# that scores every combination on every fold
+successive_halving = True
+
+# Scores of every (parameters, fold) pair are kept in search_cache/, so
+# re-running after editing `parameters` only fits the new grid points, in
+# either search; set to None to always refit
+search_cache_dir = search_cache.CACHE_DIR
+
 # Create, fit, and make predictions with grid search
-grid_search = GridSearchCV(pipeline,
-  	              param_grid=parameters,
-  	              scoring = 'f1',
-  	              cv=scv,
-  	              error_score=0)
+grid_search = HalvingGridSearch(pipeline,
+                  param_grid=parameters,
+                  scoring = 'f1',
+                  cv=scv,
+                  error_score=0,
+                  min_folds=5 if successive_halving else None,
+                  cache_dir=search_cache_dir)
+instrument.start('grid_search.fit')
 grid_search.fit(features_train, labels_train)
+instrument.stop('grid_search.fit')
+instrument.count('grid_search.fits', grid_search.n_fits_)
+if search_cache_dir is not None:
+	instrument.count('grid_search.cache_hits', grid_search.cache_hits_)
 
 # Pick the classifier with the best tuned parameters
 clf = grid_search.best_estimator_
@@ -259,4 +265,12 @@ pprint(sorted(j.items(), key=itemgetter(1), reverse=True))
 ### that the version of poi_id.py that you submit can be run on its own and
 ### generates the necessary .pkl files for validating your results.
 
-dump_classifier_and_data(clf, my_dataset, features_list)
\ No newline at end of file
+instrument.start('dump')
+dump_classifier_and_data(clf, my_dataset, features_list)
+instrument.stop('dump')
+
+if cprofile:
+    instrument.PROFILER.stop_cprofile("poi_id.prof")
+print "\n", "Stage Timings: "
+print instrument.PROFILER.summary()
+instrument.PROFILER.save(profile_report)
\ No newline at end of file
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+""" batch scoring with the classifier dumped by poi_id.py
+
+    the artifact bundle is opened once and the fitted pipeline kept in
+    memory. input records (csv with a header row, or json lines, one
+    employee per line, using the dataset's feature names) are read in
+    chunks; each chunk gets the derived features from transform.py and is
+    scored with one vectorized predict call.
+
+        python score.py employees.csv > scores.csv
+        python score.py --format jsonl --batch-size 5000 employees.jsonl
+        python score.py --serve 8000      # POST json lines to /score
+
+    records/sec (end to end, reading and writing included, and for the
+    model alone) and p50/p99 batch latency are printed to stderr at the end
+    (and served from /stats in http mode). the http server only binds to
+    127.0.0.1.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import transform
+from artifact import load_artifact
+from tester import ARTIFACT_DIRNAME
+
+BATCH_SIZE = 1000
+ID_FIELD = 'name'
+OUTPUT_FIELDS = [ID_FIELD, 'poi', 'poi_score']
+
+
+class Scorer(object):
+    def __init__(self, artifact_path = ARTIFACT_DIRNAME, id_field = ID_FIELD):
+        bundle = load_artifact(artifact_path)
+        self.clf = bundle.clf
+        self.feature_list = [f for f in bundle.feature_list if f != 'poi']
+        self.id_field = id_field
+        self.latencies = []
+        self.records = 0
+        ### wall time of whole scoring loops / requests, added by the callers
+        self.elapsed = 0.0
+
+    def features(self, df):
+        """ the classifier's input matrix for a chunk of raw records """
+        df = df.copy()
+        for column in set(transform.NUMERIC_FEATURES) | set(self.feature_list):
+            if column in transform.DERIVED_FEATURES:
+                continue
+            if column in df:
+                df[column] = pd.to_numeric(df[column], errors = 'coerce')
+            else:
+                df[column] = np.nan
+        df = transform.add_derived_features(df)
+        ### featureFormat turns missing values into 0 for training; do the same
+        return df[self.feature_list].fillna(0).values
+
+    def score_frame(self, df):
+        start = time.time()
+        X = self.features(df)
+        predictions = self.clf.predict(X)
+        if hasattr(self.clf, 'predict_proba'):
+            scores = self.clf.predict_proba(X)[:, 1]
+        else:
+            scores = predictions.astype(float)
+        self.latencies.append(time.time() - start)
+        self.records += len(df)
+
+        if self.id_field in df:
+            ids = df[self.id_field].values
+        else:
+            ids = np.arange(self.records - len(df), self.records)
+        return pd.DataFrame({ID_FIELD: ids, 'poi': predictions.astype(int), 'poi_score': scores},
+                            columns = OUTPUT_FIELDS)
+
+    def score_records(self, records):
+        return self.score_frame(pd.DataFrame.from_records(records))
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        model_elapsed = latencies.sum() / 1000
+        return {
+            'records': self.records,
+            'batches': len(latencies),
+            'records_per_sec': self.records / self.elapsed if self.elapsed else 0.0,
+            'model_records_per_sec': self.records / model_elapsed if model_elapsed else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        }
+
+
+def read_csv_chunks(f, batch_size):
+    for chunk in pd.read_csv(f, chunksize = batch_size):
+        yield chunk
+
+
+def read_jsonl_chunks(f, batch_size):
+    records = []
+    for line in f:
+        if line.strip():
+            records.append(json.loads(line))
+        if len(records) == batch_size:
+            yield pd.DataFrame.from_records(records)
+            records = []
+    if records:
+        yield pd.DataFrame.from_records(records)
+
+
+def to_jsonl(scored):
+    return "".join(json.dumps(record) + "\n" for record in scored.to_dict('records'))
+
+
+def score_file(scorer, f, out, fmt = 'csv', batch_size = BATCH_SIZE):
+    start = time.time()
+    chunks = read_jsonl_chunks(f, batch_size) if fmt == 'jsonl' else read_csv_chunks(f, batch_size)
+    header = True
+    try:
+        for chunk in chunks:
+            scored = scorer.score_frame(chunk)
+            if fmt == 'jsonl':
+                out.write(to_jsonl(scored))
+            else:
+                scored.to_csv(out, header = header, index = False)
+                header = False
+    finally:
+        scorer.elapsed += time.time() - start
+
+
+def print_stats(stats, out = sys.stderr):
+    print >> out, "Scored {records} records in {batches} batches: {records_per_sec:.0f} records/sec " \
+                  "({model_records_per_sec:.0f} model only), p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms " \
+                  "per batch".format(**stats)
+
+
+def make_handler(scorer):
+    class ScoreHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def _reply(self, code, body, content_type = 'application/json'):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, json.dumps(scorer.stats()))
+            else:
+                self._reply(404, json.dumps({'error': 'not found'}))
+
+        def do_POST(self):
+            if self.path != '/score':
+                return self._reply(404, json.dumps({'error': 'not found'}))
+            start = time.time()
+            body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+            try:
+                if body.lstrip().startswith('['):
+                    records = json.loads(body)
+                else:
+                    records = [json.loads(line) for line in body.splitlines() if line.strip()]
+                if not all(isinstance(record, dict) for record in records):
+                    raise TypeError("every record must be a json object")
+                scored = scorer.score_records(records)
+            except (KeyError, TypeError, ValueError) as e:
+                return self._reply(400, json.dumps({'error': "malformed records: {0}".format(e)}))
+            self._reply(200, to_jsonl(scored), 'application/x-ndjson')
+            scorer.elapsed += time.time() - start
+
+    return ScoreHandler
+
+
+def serve(scorer, port):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), make_handler(scorer))
+    print >> sys.stderr, "Scoring on http://127.0.0.1:{0}/score".format(port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print_stats(scorer.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Score employee records with the dumped POI classifier.")
+    parser.add_argument('input', nargs = '?', help = "csv or json lines file (default: stdin)")
+    parser.add_argument('--output', help = "where to write the scores (default: stdout)")
+    parser.add_argument('--format', choices = ['csv', 'jsonl'],
+                        help = "input/output format (default: from the input extension, else csv)")
+    parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+    parser.add_argument('--artifact', default = ARTIFACT_DIRNAME)
+    parser.add_argument('--serve', type = int, metavar = 'PORT', help = "run the localhost http scorer")
+    args = parser.parse_args()
+
+    scorer = Scorer(args.artifact)
+    if args.serve:
+        serve(scorer, args.serve)
+        sys.exit(0)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.input and args.input.endswith(('.jsonl', '.json')) else 'csv'
+    infile = open(args.input) if args.input else sys.stdin
+    outfile = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        score_file(scorer, infile, outfile, fmt, args.batch_size)
+    finally:
+        if args.input:
+            infile.close()
+        if args.output:
+            outfile.close()
+    print_stats(scorer.stats())
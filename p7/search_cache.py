@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+""" persistent (pipeline config, params, fold) -> score cache for parameter searches
+
+    a ScoreCache is keyed by everything that decides a cv score besides the
+    grid point: the estimator's configuration, the training data, the folds,
+    the scoring and the sklearn version. inside it, scores are stored per
+    (params, fold index). re-running a search after editing the parameters
+    dict then only fits the new grid points; the rest are read back.
+
+    the scores are kept in one json file per search under CACHE_DIR and
+    rewritten (temporary name, then rename) whenever save() is called.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import sklearn
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_cache")
+
+
+def describe(value):
+    """ a repr that is stable across runs: estimators by class and params, functions by name """
+    if hasattr(value, 'get_params') and not isinstance(value, type):
+        params = value.get_params(deep = False)
+        return "{0}({1})".format(type(value).__name__,
+                                 ", ".join("{0}={1}".format(k, describe(params[k])) for k in sorted(params)))
+    if isinstance(value, (list, tuple)):
+        return "[{0}]".format(", ".join(describe(v) for v in value))
+    if isinstance(value, dict):
+        return "{{{0}}}".format(", ".join("{0}: {1}".format(k, describe(value[k])) for k in sorted(value)))
+    if callable(value) and hasattr(value, '__name__'):
+        return "{0}.{1}".format(getattr(value, '__module__', ''), value.__name__)
+    return repr(value)
+
+
+def params_key(params):
+    return describe(params)
+
+
+def search_key(estimator, X, y, folds, scoring):
+    digest = hashlib.sha1(describe(estimator))
+    digest.update(np.ascontiguousarray(X, dtype = np.float64).tostring())
+    digest.update(np.ascontiguousarray(y, dtype = np.float64).tostring())
+    for train, test in folds:
+        digest.update(np.ascontiguousarray(train, dtype = np.int64).tostring())
+        digest.update(np.ascontiguousarray(test, dtype = np.int64).tostring())
+    digest.update("{0}|{1}".format(describe(scoring), sklearn.__version__))
+    return digest.hexdigest()[:20]
+
+
+class ScoreCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.scores = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.scores = json.load(f)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_search(cls, estimator, X, y, folds, scoring, cache_dir = CACHE_DIR):
+        key = search_key(estimator, X, y, folds, scoring)
+        return cls(os.path.join(cache_dir, "scores_{0}.json".format(key)))
+
+    def get(self, params, fold):
+        score = self.scores.get(params_key(params), {}).get(str(fold))
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return score
+
+    def put(self, params, fold, score):
+        self.scores.setdefault(params_key(params), {})[str(fold)] = score
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "{0}.{1}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.scores, f)
+        os.rename(tmp, self.path)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+""" the featureFormat cache returns fresh matrices whenever the dict changes """
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from feature_cache import cached_feature_format
+from feature_format import featureFormat
+
+FEATURES = ['poi', 'salary', 'bonus']
+
+
+def make_dataset():
+    return {
+        'ALLEN PHILLIP K': {'poi': False, 'salary': 201955, 'bonus': 4175000},
+        'BELDEN TIMOTHY N': {'poi': True, 'salary': 213999, 'bonus': 5249999},
+        'BUY RICHARD B': {'poi': False, 'salary': 330546, 'bonus': 'NaN'},
+        'CAUSEY RICHARD A': {'poi': True, 'salary': 415189, 'bonus': 1000000},
+    }
+
+
+class FeatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def cached(self, dataset, version = 'v1'):
+        return cached_feature_format(dataset, FEATURES, version = version, cache_dir = self.cache_dir,
+                                     sort_keys = True)
+
+    def test_hit_and_miss_match_feature_format(self):
+        dataset = make_dataset()
+        expected = featureFormat(dataset, FEATURES, sort_keys = True)
+        miss = self.cached(dataset)
+        hit = self.cached(dataset)
+        for data in (miss, hit):
+            self.assertIsInstance(data, np.memmap)
+            self.assertFalse(data.flags.writeable)
+            np.testing.assert_array_equal(data, expected)
+
+    def test_changed_dict_under_same_version(self):
+        dataset = make_dataset()
+        self.assertEqual(self.cached(dataset).shape, (4, 3))
+
+        dataset.pop('ALLEN PHILLIP K')
+        self.assertEqual(self.cached(dataset).shape, (3, 3))
+
+        dataset['BUY RICHARD B']['bonus'] = 700000
+        np.testing.assert_array_equal(self.cached(dataset), featureFormat(dataset, FEATURES, sort_keys = True))
+
+    def test_changed_feature_list(self):
+        dataset = make_dataset()
+        data = cached_feature_format(dataset, FEATURES[:2], cache_dir = self.cache_dir, sort_keys = True)
+        self.assertEqual(data.shape, (4, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,17 +4,24 @@
     and checking the results that they get from it 
  
     requires that the algorithm, dataset, and features list
-    be written to my_classifier.pkl, my_dataset.pkl, and
-    my_feature_list.pkl, respectively
+    be written to the my_artifact bundle (see artifact.py);
+    my_classifier.pkl, my_dataset.pkl, and my_feature_list.pkl
+    are still read if there is no bundle
 
     that process should happen at the end of poi_id.py
 """
 
+import multiprocessing
 import pickle
 import sys
-from sklearn.cross_validation import StratifiedShuffleSplit
+import os
+import time
+import numpy as np
+import instrument
+from artifact import Artifact, dump_artifact, load_artifact
+from fold_store import FoldStore, stratified_folds
 sys.path.append("../tools/")
-from feature_format import featureFormat, targetFeatureSplit
+from feature_cache import cached_feature_format
 
 PERF_FORMAT_STRING = "\
 \tAccuracy: {:>0.{display_precision}f}\tPrecision: {:>0.{display_precision}f}\t\
@@ -22,43 +29,104 @@ Recall: {:>0.{display_precision}f}\tF1: {:>0.{display_precision}f}\tF2: {:>0.{di
 RESULTS_FORMAT_STRING = "\tTotal predictions: {:4d}\tTrue positives: {:4d}\tFalse positives: {:4d}\
 \tFalse negatives: {:4d}\tTrue negatives: {:4d}"
 
-def test_classifier(clf, dataset, feature_list, folds = 1000):
-    data = featureFormat(dataset, feature_list, sort_keys = True)
-    labels, features = targetFeatureSplit(data)
-    cv = StratifiedShuffleSplit(labels, folds, random_state = 42)
+def count_fold(clf, features, labels, train_idx, test_idx):
+    """
+    Fit and predict one fold; return (tn, fn, fp, tp, valid, fit_seconds,
+    predict_seconds). Like the original if/elif tally, counting stops at the
+    first prediction that is not 0 or 1.
+    """
+    start = time.time()
+    clf.fit(features[train_idx], labels[train_idx])
+    fitted = time.time()
+    predictions = np.asarray(clf.predict(features[test_idx]))
+    predicted = time.time()
+    truth = labels[test_idx]
+
+    valid = ((predictions == 0) | (predictions == 1)) & ((truth == 0) | (truth == 1))
+    all_valid = bool(valid.all())
+    if not all_valid:
+        first_invalid = int(np.argmin(valid))
+        predictions = predictions[:first_invalid]
+        truth = truth[:first_invalid]
+
+    positive = predictions == 1
+    actual = truth == 1
+    return (int(np.sum(~positive & ~actual)), int(np.sum(~positive & actual)),
+            int(np.sum(positive & ~actual)), int(np.sum(positive & actual)), all_valid,
+            fitted - start, predicted - fitted)
+
+def _split(data):
+    """labels and features columns of a featureFormat matrix, without copying a memmap"""
+    data = np.asarray(data)
+    return data[:, 0], data[:, 1:]
+
+def _count_folds(args):
+    """
+    Pool worker: tally folds [start, stop) of the fold store with its own copy of clf.
+    data is the featureFormat matrix, or the path of a .npy holding it to memory-map.
+    """
+    clf, data, fold_path, start, stop = args
+    if isinstance(data, basestring):
+        data = np.load(data, mmap_mode = "r")
+    labels, features = _split(data)
+    cv = FoldStore(fold_path)
+    return [count_fold(clf, features, labels, *cv[i]) for i in range(start, stop)]
+
+def test_classifier(clf, dataset, feature_list, folds = 1000, n_jobs = 1):
+    """
+    Evaluate clf over StratifiedShuffleSplit folds. With n_jobs > 1 the folds are
+    spread over a process pool, each worker fitting its own copy of clf; the totals
+    are the same as a sequential run as long as clf has a fixed random_state.
+
+    dataset may also be an opened Artifact; its memory-mapped features matrix is
+    used directly and workers map the same file instead of receiving a copy.
+    """
+    data_source = None
+    if isinstance(dataset, Artifact) and dataset.feature_list == list(feature_list):
+        data = dataset.features
+        data_source = dataset.features_path
+    else:
+        if isinstance(dataset, Artifact):
+            dataset = dataset.dataset()
+        with instrument.timer('tester.featureFormat'):
+            data = cached_feature_format(dataset, feature_list, sort_keys = True)
+    labels, features = _split(data)
+    cv = stratified_folds(labels, folds, seed = 42)
+
+    instrument.start('tester.evaluate')
+    if n_jobs > 1:
+        if data_source is None:
+            data_source = data
+        chunk_size = max(1, len(cv) // (n_jobs * 4))
+        tasks = [(clf, data_source, cv.path, i, min(i + chunk_size, len(cv)))
+                 for i in range(0, len(cv), chunk_size)]
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            results = [r for chunk in pool.map(_count_folds, tasks) for r in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [count_fold(clf, features, labels, train_idx, test_idx) for train_idx, test_idx in cv]
+    instrument.stop('tester.evaluate')
+
     true_negatives = 0
     false_negatives = 0
     true_positives = 0
     false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        ### fit the classifier using training set, and test on test set
-        clf.fit(features_train, labels_train)
-        predictions = clf.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            else:
-                print "Warning: Found a predicted label not == 0 or 1."
-                print "All predictions should take value 0 or 1."
-                print "Evaluating performance for processed predictions:"
-                break
+    for tn, fn, fp, tp, all_valid, fit_seconds, predict_seconds in results:
+        instrument.add_time('tester.fold.fit', fit_seconds)
+        instrument.add_time('tester.fold.predict', predict_seconds)
+        instrument.count('tester.folds')
+        instrument.count('tester.predictions', tn + fn + fp + tp)
+        true_negatives += tn
+        false_negatives += fn
+        false_positives += fp
+        true_positives += tp
+        if not all_valid:
+            print "Warning: Found a predicted label not == 0 or 1."
+            print "All predictions should take value 0 or 1."
+            print "Evaluating performance for processed predictions:"
     try:
         total_predictions = true_negatives + false_negatives + false_positives + true_positives
         accuracy = 1.0*(true_positives + true_negatives)/total_predictions
@@ -77,16 +145,25 @@ def test_classifier(clf, dataset, feature_list, folds = 1000):
 CLF_PICKLE_FILENAME = "my_classifier.pkl"
 DATASET_PICKLE_FILENAME = "my_dataset.pkl"
 FEATURE_LIST_FILENAME = "my_feature_list.pkl"
+ARTIFACT_DIRNAME = "my_artifact"
 
 def dump_classifier_and_data(clf, dataset, feature_list):
-    with open(CLF_PICKLE_FILENAME, "w") as clf_outfile:
-        pickle.dump(clf, clf_outfile)
-    with open(DATASET_PICKLE_FILENAME, "w") as dataset_outfile:
-        pickle.dump(dataset, dataset_outfile)
-    with open(FEATURE_LIST_FILENAME, "w") as featurelist_outfile:
-        pickle.dump(feature_list, featurelist_outfile)
+    dump_artifact(ARTIFACT_DIRNAME, clf, dataset, feature_list)
+
+def load_artifact_or_pickles():
+    """
+    (clf, dataset, feature_list) where dataset is the opened Artifact; falls back
+    to the three legacy pickles when no bundle has been written yet
+    """
+    if os.path.isdir(ARTIFACT_DIRNAME):
+        bundle = load_artifact(ARTIFACT_DIRNAME)
+        return bundle.clf, bundle, bundle.feature_list
+    return load_classifier_and_data()
 
 def load_classifier_and_data():
+    if os.path.isdir(ARTIFACT_DIRNAME):
+        bundle = load_artifact(ARTIFACT_DIRNAME)
+        return bundle.clf, bundle.dataset(), bundle.feature_list
     with open(CLF_PICKLE_FILENAME, "r") as clf_infile:
         clf = pickle.load(clf_infile)
     with open(DATASET_PICKLE_FILENAME, "r") as dataset_infile:
@@ -95,11 +172,18 @@ def load_classifier_and_data():
         feature_list = pickle.load(featurelist_infile)
     return clf, dataset, feature_list
 
-def main():
+def main(n_jobs = 1, report_path = None):
     ### load up student's classifier, dataset, and feature_list
-    clf, dataset, feature_list = load_classifier_and_data()
+    with instrument.timer('tester.load'):
+        clf, dataset, feature_list = load_artifact_or_pickles()
     ### Run testing script
-    test_classifier(clf, dataset, feature_list)
+    test_classifier(clf, dataset, feature_list, n_jobs = n_jobs)
+    if report_path:
+        print instrument.PROFILER.summary()
+        instrument.PROFILER.save(report_path)
 
 if __name__ == '__main__':
-    main()
+    ### optional: number of worker processes and a path for the timing report,
+    ### e.g. python tester.py 4 tester_profile.json
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1,
+         sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+""" columnar data-correction and feature-engineering stage
+
+    the enron dict of dicts is loaded once into a DataFrame with real NaNs
+    and float columns. known row errors are declared as data
+    (ROW_CORRECTIONS) and derived features are registered functions of whole
+    columns (DERIVED_FEATURES), so every step is a vectorized operation
+    instead of a python loop over employees.
+
+    to_data_dict() turns the frame back into the 'NaN'-string dict that
+    featureFormat and tester.py expect.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from pandas import DataFrame
+
+### every numeric column of final_project_dataset.pkl
+NUMERIC_FEATURES = ['salary', 'deferral_payments', 'total_payments',
+'loan_advances', 'bonus', 'restricted_stock_deferred', 'deferred_income',
+'total_stock_value', 'expenses', 'exercised_stock_options', 'other',
+'long_term_incentive', 'restricted_stock', 'director_fees',
+'to_messages', 'from_poi_to_this_person', 'from_messages',
+'from_this_person_to_poi', 'shared_receipt_with_poi']
+
+### payment and stock columns in the order of the insider pay pdf
+PAYMENT_FEATURES = ['salary', 'bonus', 'long_term_incentive', 'deferred_income', 'deferral_payments',
+'loan_advances', 'other', 'expenses', 'director_fees', 'total_payments', 'exercised_stock_options',
+'restricted_stock', 'restricted_stock_deferred', 'total_stock_value']
+
+### rows that are not employees but look like one to the numbers
+### (outlier_scan.py finds TOTAL on its own)
+NON_EMPLOYEES = ["THE TRAVEL AGENCY IN THE PARK"]
+OUTLIERS = ["TOTAL"] + NON_EMPLOYEES
+
+### (employee, columns, shift): the employee's values were entered one column
+### off in the pdf; shift them back along the columns, filling with NaN
+ROW_CORRECTIONS = [
+    ('BHATNAGAR SANJAY', PAYMENT_FEATURES, 1),
+    ('BELFER ROBERT', PAYMENT_FEATURES[3:], -1),
+]
+
+DERIVED_FEATURES = OrderedDict()
+
+
+def register_feature(name, func):
+    """ add a derived feature: func(df) returns a column (Series) for name """
+    DERIVED_FEATURES[name] = func
+
+
+def register_ratio(name, numerator, denominator):
+    """ derived feature numerator / denominator, NaN where either is missing or zero """
+    def ratio(df):
+        return df[numerator] / df[denominator].replace(0, np.nan)
+    register_feature(name, ratio)
+
+
+register_ratio('received_from_poi_ratio', 'from_poi_to_this_person', 'to_messages')
+register_ratio('sent_to_poi_ratio', 'from_this_person_to_poi', 'from_messages')
+register_ratio('shared_receipt_with_poi_ratio', 'shared_receipt_with_poi', 'to_messages')
+
+
+def load_frame(data_dict, numeric_features = NUMERIC_FEATURES):
+    """ one row per employee, 'NaN' strings as real NaNs, numeric columns as floats """
+    df = DataFrame.from_dict(data_dict, orient = 'index')
+    df = df.replace('NaN', np.nan)
+    df[numeric_features] = df[numeric_features].astype(float)
+    return df
+
+
+def drop_outliers(df, outliers = OUTLIERS):
+    return df.drop([name for name in outliers if name in df.index])
+
+
+def apply_corrections(df, corrections = ROW_CORRECTIONS):
+    for employee, columns, shift in corrections:
+        if employee in df.index:
+            df.loc[employee, columns] = df.loc[employee, columns].astype(float).shift(shift).values
+    return df
+
+
+def add_derived_features(df, features = DERIVED_FEATURES):
+    for name, func in features.items():
+        df[name] = func(df)
+    return df
+
+
+def prepare(data_dict, outliers = OUTLIERS):
+    """ Tasks 2-3 of poi_id.py: drop outliers, repair rows, add derived features """
+    df = drop_outliers(load_frame(data_dict), outliers)
+    df = apply_corrections(df)
+    return add_derived_features(df)
+
+
+def to_data_dict(df, numeric_features = NUMERIC_FEATURES):
+    """ back to {employee: {feature: value}} with 'NaN' strings; whole numbers of the
+        original columns come back as ints like in the source pickle """
+    numeric = set(numeric_features)
+    data_dict = {}
+    for employee, row in zip(df.index, df.to_dict('records')):
+        record = {}
+        for feature, value in row.items():
+            if isinstance(value, float):
+                if np.isnan(value):
+                    value = 'NaN'
+                elif feature in numeric and value.is_integer():
+                    value = int(value)
+            record[feature] = value
+        data_dict[employee] = record
+    return data_dict